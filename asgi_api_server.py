@@ -0,0 +1,196 @@
+# --- Parte 1: Importaciones y Configuración ---
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import local_api_server as core # Misma carga de modelo, reglas, caché y micro-batching
+
+# Configuración del servidor
+PORT = 5000
+
+# Ejecución acotada: hilos que esperan al modelo y cola máxima antes de rechazar
+INFERENCE_WORKERS = 16       # Peticiones en vuelo hacia el micro-batching de local_api_server
+MAX_QUEUE = 64               # Peticiones pendientes (en vuelo + esperando hilo) antes de responder 429
+REQUEST_TIMEOUT_S = 5.0      # Plazo por petición; si vence se responde 503
+CARGA_EN_SEGUNDO_PLANO = True # El arranque no espera al modelo (503 hasta que esté listo); False = arranque bloqueante
+
+# Estado global del servidor
+executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inferencia")
+pendientes = 0               # Peticiones aceptadas cuyo hilo de inferencia aún no ha terminado
+contadores = {"aceptadas": 0, "rechazadas_429": 0, "rechazadas_503": 0, "timeouts": 0, "errores": 0}
+esperas_ms = deque(maxlen=1000) # Tiempo en cola hasta empezar la inferencia (últimas 1000)
+
+# --- Parte 2: Inferencia en el executor con plazo ---
+
+def _predict_con_plazo(peticion, contexto_base, adaptador, llegada, plazo):
+    """Se ejecuta en un hilo del executor; descarta el trabajo si el plazo ya venció en la cola."""
+    inicio = time.monotonic()
+    esperas_ms.append((inicio - llegada) * 1000)
+    if inicio >= plazo:
+        raise TimeoutError("Plazo vencido antes de empezar la inferencia")
+    return core.predict_time(peticion, contexto_base, adaptador=adaptador, plazo=plazo)
+
+def _liberar(_futuro):
+    """Descuenta una petición pendiente (en el event loop) cuando su hilo termina o se cancela en cola."""
+    global pendientes
+    pendientes -= 1
+
+def _percentil(valores, p):
+    """Percentil simple (vecino más cercano) de una lista de valores."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))], 2)
+
+async def predict(data):
+    """Resuelve una petición /predict_time; devuelve (status, cuerpo)."""
+    global pendientes
+
+    peticion = data.get('peticion') if isinstance(data, dict) else None
+    contexto_base = data.get('contexto_base') if isinstance(data, dict) else None
+    if not peticion or not contexto_base:
+        return 400, {"error": "Faltan los campos 'peticion' o 'contexto_base' en el JSON."}
+
+    # Rechazo rápido: modelo sin cargar o cola llena
+    if not core.model_ready.is_set():
+        contadores["rechazadas_503"] += 1
+        if core.load_error is not None:
+            return 503, {"error": f"Error cargando el modelo: {core.load_error}"}
+        return 503, {"error": "Modelo no cargado todavía."}
+    if pendientes >= MAX_QUEUE:
+        contadores["rechazadas_429"] += 1
+        return 429, {"error": f"Cola llena ({MAX_QUEUE} peticiones pendientes). Reintenta más tarde."}
+
+    contadores["aceptadas"] += 1
+    llegada = time.monotonic()
+    loop = asyncio.get_running_loop()
+    futuro = executor.submit(_predict_con_plazo, peticion, contexto_base, data.get('adaptador'),
+                             llegada, llegada + REQUEST_TIMEOUT_S)
+    # La petición sigue pendiente mientras su hilo trabaja, aunque ya se haya respondido 503 por plazo
+    pendientes += 1
+    futuro.add_done_callback(lambda f: loop.call_soon_threadsafe(_liberar, f))
+    try:
+        salida_absoluta = await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=REQUEST_TIMEOUT_S)
+    except (asyncio.TimeoutError, TimeoutError):
+        contadores["timeouts"] += 1
+        return 503, {"error": f"Plazo de {REQUEST_TIMEOUT_S}s superado."}
+    except Exception as e:
+        contadores["errores"] += 1
+        return 500, {"error": f"Error interno del servidor: {str(e)}"}
+
+    if isinstance(salida_absoluta, tuple):
+        # (mensaje, status): adaptador desconocido o modelo sin cargar
+        return salida_absoluta[1], {"error": salida_absoluta[0]}
+    return 200, {
+        "peticion_recibida": peticion,
+        "contexto_base": contexto_base,
+        "salida_absoluta": salida_absoluta
+    }
+
+def stats():
+    """Profundidad de cola, rechazos y tiempos de espera en cola."""
+    esperas = list(esperas_ms)
+    return {
+        "modelo_listo": core.model_ready.is_set(),
+        "error_carga": core.load_error,
+        "pendientes": pendientes,
+        "max_queue": MAX_QUEUE,
+        "inference_workers": INFERENCE_WORKERS,
+        "cola_micro_batching": core.batch_queue.qsize(),
+        **contadores,
+        "espera_ms_p50": _percentil(esperas, 50),
+        "espera_ms_p95": _percentil(esperas, 95),
+        "espera_ms_max": round(max(esperas), 2) if esperas else None,
+    }
+
+# --- Parte 3: Aplicación ASGI ---
+
+async def _leer_cuerpo(receive):
+    cuerpo = b""
+    while True:
+        mensaje = await receive()
+        cuerpo += mensaje.get("body", b"")
+        if not mensaje.get("more_body", False):
+            return cuerpo
+
+async def _responder(send, status, contenido, content_type=b"application/json"):
+    if isinstance(contenido, str):
+        cuerpo = contenido.encode("utf-8")
+    else:
+        cuerpo = json.dumps(contenido, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+async def _lifespan(receive, send):
+    """
+    Carga y calienta el modelo sin bloquear el event loop. En segundo plano el servidor responde 503
+    hasta que está listo; con arranque bloqueante, un fallo de carga se notifica con startup.failed.
+    """
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "lifespan.startup":
+            try:
+                hilo = core.start_background_loading()
+                if not CARGA_EN_SEGUNDO_PLANO:
+                    await asyncio.get_running_loop().run_in_executor(None, hilo.join)
+                    if core.load_error is not None:
+                        raise RuntimeError(core.load_error)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": f"Error cargando el modelo: {e}"})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif mensaje["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """Aplicación ASGI con el mismo contrato que /predict_time de local_api_server.py."""
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    ruta, metodo = scope["path"], scope["method"]
+    if ruta == "/predict_time" and metodo == "POST":
+        try:
+            data = json.loads(await _leer_cuerpo(receive) or b"null")
+        except ValueError:
+            return await _responder(send, 400, {"error": "El cuerpo no es un JSON válido."})
+        status, contenido = await predict(data)
+        return await _responder(send, status, contenido)
+
+    if ruta == "/stats" and metodo == "GET":
+        return await _responder(send, 200, stats())
+
+    if ruta == "/metrics" and metodo == "GET":
+        # Mismas métricas del hot path que local_api_server.py (comparten el módulo metricas)
+        texto = core.metricas.render(core.metricas_en_vivo())
+        return await _responder(send, 200, texto, b"text/plain; version=0.0.4")
+
+    return await _responder(send, 404, {"error": f"Ruta no encontrada: {metodo} {ruta}"})
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Servidor ASGI de predicción TLP (asyncio + uvicorn).")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE)
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT_S, help="Plazo por petición en segundos.")
+    parser.add_argument("--carga-bloqueante", action="store_true",
+                        help="No acepta conexiones hasta cargar el modelo (y no arranca si falla la carga).")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    import uvicorn
+
+    args = parse_args()
+    MAX_QUEUE = args.max_queue
+    REQUEST_TIMEOUT_S = args.timeout
+    CARGA_EN_SEGUNDO_PLANO = not args.carga_bloqueante
+
+    print(f"Servidor ASGI en el puerto {args.port}: POST /predict_time, GET /stats, GET /metrics.")
+    uvicorn.run(app, host='0.0.0.0', port=args.port, lifespan="on")
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import bisect
+import random
+import argparse
+import tempfile
+import threading
+import itertools
+import importlib
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuración por defecto ---
+URL = "http://localhost:5000/predict_time"
+DATASET_FILE = "datos_horas_tlp_v4.jsonl"
+CONCURRENCIA = 8
+DURACION_S = 30
+TIMEOUT_S = 30
+SLO_P95_MS = 1000 # Un nivel de RPS se considera saturado si el p95 supera este valor
+HISTOGRAMA_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# --- Carga de peticiones ---
+
+def cargar_peticiones(fichero=None, sinteticas=0, semilla=0):
+    """Lee pares (peticion, contexto_base) de un JSONL o los genera con el generador TLP."""
+    if sinteticas:
+        random.seed(semilla)
+        generador = importlib.import_module("generarDatasetConDías")
+        with tempfile.TemporaryDirectory() as tmp:
+            fichero = os.path.join(tmp, "sinteticas.jsonl")
+            generador.generate_tlp_dataset(num_examples=sinteticas, output_file=fichero)
+            return cargar_peticiones(fichero)
+
+    peticiones = []
+    with open(fichero, encoding='utf-8') as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            fila = json.loads(linea)
+            if 'peticion' in fila and 'contexto_base' in fila:
+                peticiones.append({"peticion": fila['peticion'], "contexto_base": fila['contexto_base']})
+    return peticiones
+
+# --- Envío de peticiones ---
+
+def enviar(url, item, timeout=TIMEOUT_S):
+    """
+    POST de una petición con "debug": true; devuelve (status HTTP o None, salida_absoluta o mensaje de
+    error, ruta que la resolvió: reglas, cache o modelo; None si el servidor no la informa).
+    """
+    cuerpo = json.dumps({**item, "debug": True}, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url, data=cuerpo, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as respuesta:
+            datos = json.loads(respuesta.read())
+            return respuesta.status, datos.get("salida_absoluta"), (datos.get("tiempos") or {}).get("ruta")
+    except urllib.error.HTTPError as e:
+        return e.code, e.reason, None
+    except Exception as e:
+        return None, type(e).__name__, None
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))], 2)
+
+def _resumen(resultados, duracion, rps_objetivo, concurrencia):
+    """Agrega latencias, histograma y errores de un nivel de carga."""
+    latencias = sorted(r["latencia_ms"] for r in resultados)
+    estados = {}
+    for r in resultados:
+        clave = str(r["status"]) if r["status"] is not None else f"excepcion:{r['detalle']}"
+        estados[clave] = estados.get(clave, 0) + 1
+
+    correctas = [r for r in resultados if r["status"] == 200]
+    # Peticiones servidas por cada ruta: con el dataset TLP las reglas lo resuelven todo y el modelo no
+    # llega a ejecutarse (arranca el servidor con --sin-reglas --sin-cache para medir model.generate)
+    rutas = {}
+    for r in correctas:
+        ruta = r["ruta"] or "desconocida"
+        rutas[ruta] = rutas.get(ruta, 0) + 1
+    error_parsing = sum(1 for r in correctas if str(r["detalle"]).startswith("ERROR_PARSING"))
+    errores = len(resultados) - len(correctas)
+
+    etiquetas = [f"<={limite}ms" for limite in HISTOGRAMA_MS] + [f">{HISTOGRAMA_MS[-1]}ms"]
+    histograma = dict.fromkeys(etiquetas, 0)
+    for latencia in latencias:
+        histograma[etiquetas[bisect.bisect_left(HISTOGRAMA_MS, latencia)]] += 1
+
+    return {
+        "rps_objetivo": rps_objetivo,
+        "concurrencia": concurrencia,
+        "peticiones": len(resultados),
+        "duracion_s": round(duracion, 2),
+        "throughput_rps": round(len(resultados) / duracion, 2) if duracion else None,
+        "tasa_error": round(errores / len(resultados), 4) if resultados else None,
+        "tasa_error_parsing": round(error_parsing / len(correctas), 4) if correctas else None,
+        "estados": estados,
+        "rutas": rutas,
+        "latencia_ms": {
+            "p50": _percentil(latencias, 50),
+            "p90": _percentil(latencias, 90),
+            "p95": _percentil(latencias, 95),
+            "p99": _percentil(latencias, 99),
+            "max": round(latencias[-1], 2) if latencias else None,
+        },
+        "histograma_ms": histograma,
+    }
+
+def ejecutar_nivel(url, peticiones, concurrencia, duracion_s, rps=None):
+    """
+    Lanza carga durante 'duracion_s' segundos.
+    Con 'rps' la carga es de bucle abierto: cada petición tiene su hora programada y la latencia
+    se mide desde esa hora (incluye la espera si todos los hilos están ocupados).
+    Sin 'rps' cada hilo envía peticiones una tras otra (bucle cerrado).
+    """
+    resultados = []
+    lock = threading.Lock()
+    inicio = time.monotonic()
+    fin = inicio + duracion_s
+
+    def _uno(item, programada):
+        status, detalle, ruta = enviar(url, item)
+        latencia_ms = (time.monotonic() - programada) * 1000
+        with lock:
+            resultados.append({"status": status, "detalle": detalle, "ruta": ruta, "latencia_ms": latencia_ms})
+
+    if rps:
+        with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+            i = 0
+            while True:
+                programada = inicio + i / rps
+                if programada >= fin:
+                    break
+                espera = programada - time.monotonic()
+                if espera > 0:
+                    time.sleep(espera)
+                executor.submit(_uno, peticiones[i % len(peticiones)], programada)
+                i += 1
+    else:
+        contador = itertools.count()
+
+        def _bucle():
+            while time.monotonic() < fin:
+                with lock:
+                    i = next(contador)
+                _uno(peticiones[i % len(peticiones)], time.monotonic())
+
+        hilos = [threading.Thread(target=_bucle) for _ in range(concurrencia)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+    return _resumen(resultados, time.monotonic() - inicio, rps, concurrencia)
+
+def detectar_saturacion(niveles, slo_p95_ms=SLO_P95_MS):
+    """Primer nivel de RPS que no se sostiene: throughput < 90% del objetivo, >1% de errores o p95 > SLO."""
+    for nivel in niveles:
+        motivos = []
+        if nivel["rps_objetivo"] and nivel["throughput_rps"] < 0.9 * nivel["rps_objetivo"]:
+            motivos.append("throughput")
+        if nivel["tasa_error"] and nivel["tasa_error"] > 0.01:
+            motivos.append("errores")
+        if nivel["latencia_ms"]["p95"] is not None and nivel["latencia_ms"]["p95"] > slo_p95_ms:
+            motivos.append("latencia_p95")
+        if motivos:
+            return {"rps_objetivo": nivel["rps_objetivo"], "motivos": motivos}
+    return None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de carga para /predict_time (local_api_server.py o simulacion.py).")
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--dataset", default=DATASET_FILE, help="JSONL con 'peticion' y 'contexto_base'.")
+    parser.add_argument("--sinteticas", type=int, default=0, help="Genera N peticiones con el generador TLP en vez de leer --dataset.")
+    parser.add_argument("--concurrencia", type=int, default=CONCURRENCIA)
+    parser.add_argument("--duracion", type=float, default=DURACION_S, help="Segundos por nivel de carga.")
+    parser.add_argument("--rps", type=float, default=None, help="RPS objetivo (sin él, bucle cerrado).")
+    parser.add_argument("--rps-escalones", default=None, help="Lista de RPS separados por comas para buscar la saturación.")
+    parser.add_argument("--slo-p95-ms", type=float, default=SLO_P95_MS)
+    parser.add_argument("--salida", default=None, help="Fichero JSON donde guardar el informe.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    peticiones = cargar_peticiones(args.dataset, args.sinteticas)
+    random.shuffle(peticiones)
+
+    escalones = [float(r) for r in args.rps_escalones.split(",")] if args.rps_escalones else [args.rps]
+    niveles = []
+    for rps in escalones:
+        print(f"Nivel: rps={rps or 'bucle cerrado'}, concurrencia={args.concurrencia}, {args.duracion}s...")
+        niveles.append(ejecutar_nivel(args.url, peticiones, args.concurrencia, args.duracion, rps))
+
+    informe = {
+        "url": args.url,
+        "origen": f"sinteticas:{args.sinteticas}" if args.sinteticas else args.dataset,
+        "niveles": niveles,
+        "saturacion": detectar_saturacion(niveles, args.slo_p95_ms),
+    }
+    rutas_informadas = any(ruta != "desconocida" for nivel in niveles for ruta in nivel["rutas"])
+    if rutas_informadas and not any(nivel["rutas"].get("modelo") for nivel in niveles):
+        print("Aviso: ninguna petición llegó al modelo (todas por reglas o caché); "
+              "para medir model.generate arranca el servidor con --sin-reglas --sin-cache.")
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    print(texto)
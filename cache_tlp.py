@@ -0,0 +1,111 @@
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from reglas_tlp import DIAS_SEMANA_ES, FORMATO_TLP, NUMEROS_TEXTO, normalizar_peticion, dias_hasta
+
+# Caché LRU de resultados del modelo, indexada por la petición normalizada.
+# No se guarda la salida absoluta sino una regla relativa al contexto_base
+# ("+90 min", "+1 día 21:00", "jueves 21:00") que se vuelve a aplicar a cada contexto nuevo.
+# Con varios adaptadores residentes (local_api_server.py) cada uno tiene sus propias entradas.
+CACHE_MAX_SIZE = 4096
+
+# --- CLASIFICACIÓN DE LA PETICIÓN (qué tipo de regla se puede guardar) ---
+# Relativa sólo con la cantidad justo detrás ("dentro de una hora", "en veinte minutos", "en media hora")
+_NUM = "|".join(sorted(map(re.escape, NUMEROS_TEXTO), key=len, reverse=True))
+RE_RELATIVA = re.compile(rf"\b(?:dentro de|en) (?:{_NUM}|media) (?:minutos?|horas?)\b")
+RE_DIA_SEMANA = re.compile(r"\bel (?P<dia>" + "|".join(DIAS_SEMANA_ES) + r")\b")
+RE_PASADO_MANANA = re.compile(r"\bpasado mañana\b")
+RE_MANANA = re.compile(r"(?<!esta )(?<!la )\bmañana\b")  # "esta mañana"/"de la mañana" no son un día
+RE_HOY = re.compile(r"\bhoy\b")
+
+# Estado global de la caché
+_entradas = OrderedDict()
+_lock = threading.Lock()
+_contadores = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _regla_para(texto: str, base: datetime, salida: datetime):
+    """Deduce la regla relativa de una salida del modelo, o None si depende del contexto."""
+    # Primero las reglas de día: "el viernes en la tarde a las cinco y diez minutos" no es un desplazamiento
+    hora = salida.strftime("%H:%M")
+    match = RE_DIA_SEMANA.search(texto)
+    if match:
+        return ("semana", match.group("dia"), hora)
+    if RE_PASADO_MANANA.search(texto) or RE_MANANA.search(texto) or RE_HOY.search(texto):
+        return ("dia", (salida.date() - base.date()).days, hora)
+
+    if RE_RELATIVA.search(texto):
+        return ("min", int((salida - base).total_seconds() // 60))
+
+    # "esta noche", "a las cinco", ...: el resultado depende de la hora del contexto
+    return None
+
+
+def _aplicar_regla(regla, base: datetime) -> str:
+    """Vuelve a aplicar una regla guardada sobre un contexto_base nuevo."""
+    if regla[0] == "min":
+        return (base + timedelta(minutes=regla[1])).strftime(FORMATO_TLP)
+
+    if regla[0] == "semana":
+        fecha = base + timedelta(days=dias_hasta(f"el {regla[1]}", base))
+    else:
+        fecha = base + timedelta(days=regla[1])
+    return f"{fecha.strftime('%Y-%m-%d')} {regla[2]}"
+
+
+def obtener(peticion: str, contexto_base: str, adaptador=None):
+    """Devuelve la salida absoluta para este contexto si la petición está en caché, o None."""
+    try:
+        base = datetime.strptime(contexto_base, FORMATO_TLP)
+    except ValueError:
+        return None
+
+    clave = (adaptador, normalizar_peticion(peticion))
+    with _lock:
+        regla = _entradas.get(clave)
+        if regla is None:
+            _contadores["misses"] += 1
+            return None
+        _entradas.move_to_end(clave)
+        _contadores["hits"] += 1
+
+    return _aplicar_regla(regla, base)
+
+
+def guardar(peticion: str, contexto_base: str, salida_absoluta: str, adaptador=None):
+    """Guarda la salida del modelo como regla relativa (si se puede deducir una)."""
+    try:
+        base = datetime.strptime(contexto_base, FORMATO_TLP)
+        salida = datetime.strptime(salida_absoluta, FORMATO_TLP)
+    except ValueError:
+        # Contextos mal formados o salidas ERROR_PARSING no se cachean
+        return
+
+    texto = normalizar_peticion(peticion)
+    regla = _regla_para(texto, base, salida)
+    if regla is None:
+        return
+
+    clave = (adaptador, texto)
+    with _lock:
+        _entradas[clave] = regla
+        _entradas.move_to_end(clave)
+        while len(_entradas) > CACHE_MAX_SIZE:
+            _entradas.popitem(last=False)
+            _contadores["evictions"] += 1
+
+
+def invalidar(adaptador):
+    """Elimina las entradas de un adaptador (al descargarlo o sustituirlo por otros pesos)."""
+    with _lock:
+        for clave in [clave for clave in _entradas if clave[0] == adaptador]:
+            del _entradas[clave]
+
+
+def estadisticas() -> dict:
+    """Contadores de hits/misses/evictions y ocupación actual de la caché."""
+    with _lock:
+        return dict(_contadores, size=len(_entradas), max_size=CACHE_MAX_SIZE)
+
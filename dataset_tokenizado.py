@@ -0,0 +1,115 @@
+import os
+import shutil
+import hashlib
+from datasets import load_dataset, load_from_disk, Sequence, Value
+from plantillas import PLANTILLAS
+
+# Caché de datasets pre-tokenizados (train.py y test.py).
+# Cada JSONL se tokeniza una sola vez con el tokenizer del modelo y se guarda en Arrow; las siguientes
+# ejecuciones lo abren con load_from_disk, que mapea el fichero en memoria sin copiarlo ni re-parsear el JSONL.
+# La clave incluye el hash del fichero, del tokenizer y de la plantilla: si cambia cualquiera de ellos
+# la entrada antigua deja de usarse y se vuelve a tokenizar.
+CACHE_DIR = "cache_tokenizado"
+TAMANO_BLOQUE_HASH = 1 << 20
+
+
+def huella_fichero(path: str) -> str:
+    """SHA-256 del contenido del fichero (leído por bloques)."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE_HASH), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def huella_tokenizer(tokenizer) -> str:
+    """Identifica el tokenizer por su vocabulario y reglas (tokenizer.json), no sólo por su nombre."""
+    sha = hashlib.sha256()
+    sha.update(f"{type(tokenizer).__name__}|{tokenizer.name_or_path}|{len(tokenizer)}".encode("utf-8"))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        sha.update(backend.to_str().encode("utf-8"))
+    return sha.hexdigest()
+
+
+def clave_cache(path: str, tokenizer, plantilla: str, respuesta, add_eos: bool) -> str:
+    sha = hashlib.sha256()
+    for parte in (huella_fichero(path), huella_tokenizer(tokenizer), plantilla, str(respuesta), str(add_eos)):
+        sha.update(parte.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()[:16]
+
+
+def _longitud_prefijo_comun(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def _tokenizar_jsonl(path: str, tokenizer, plantilla: str, respuesta, add_eos: bool):
+    """
+    Parsea el JSONL y añade la columna 'input_ids' (int32) con el texto de la plantilla tokenizado.
+    Con 'respuesta', input_ids es prompt + respuesta y 'completion_mask' marca con 1 los tokens de la respuesta.
+    """
+    dataset = load_dataset("json", data_files=path, split="train")
+
+    def tokenizar(lote):
+        filas = [dict(zip(lote, valores)) for valores in zip(*lote.values())]
+        prompts = [plantilla.format(**fila) for fila in filas]
+        if respuesta is None:
+            textos = [prompt + tokenizer.eos_token if add_eos else prompt for prompt in prompts]
+            return {"input_ids": tokenizer(textos)["input_ids"]}
+
+        completos = [prompt + respuesta.format(**fila) for prompt, fila in zip(prompts, filas)]
+        if add_eos:
+            completos = [texto + tokenizer.eos_token for texto in completos]
+        ids_prompts = tokenizer(prompts)["input_ids"]
+        ids_completos = tokenizer(completos)["input_ids"]
+        # La respuesta empieza donde el prompt tokenizado deja de ser prefijo del texto completo
+        mascaras = []
+        for ids_prompt, ids_completo in zip(ids_prompts, ids_completos):
+            n = _longitud_prefijo_comun(ids_prompt, ids_completo)
+            mascaras.append([0] * n + [1] * (len(ids_completo) - n))
+        return {"input_ids": ids_completos, "completion_mask": mascaras}
+
+    dataset = dataset.map(tokenizar, batched=True, desc=f"Tokenizando {os.path.basename(path)}")
+    dataset = dataset.cast_column("input_ids", Sequence(Value("int32")))
+    if respuesta is not None:
+        dataset = dataset.cast_column("completion_mask", Sequence(Value("int8")))
+    return dataset
+
+
+def cargar_tokenizado(path: str, tokenizer, plantilla: str, respuesta=None, add_eos: bool = False):
+    """
+    Devuelve el dataset de 'path' con sus columnas originales más 'input_ids' (plantilla.format(**fila)).
+    Si se pasa la plantilla de 'respuesta' se añade tras el prompt y se devuelve también 'completion_mask'.
+    Usa la caché de CACHE_DIR si existe una entrada con la misma clave; si no, la crea.
+    """
+    nombre = os.path.splitext(os.path.basename(path))[0]
+    destino = os.path.join(CACHE_DIR, f"{nombre}-{clave_cache(path, tokenizer, plantilla, respuesta, add_eos)}")
+    if os.path.isdir(destino):
+        print(f"Dataset pre-tokenizado: {destino}")
+        return load_from_disk(destino)
+
+    dataset = _tokenizar_jsonl(path, tokenizer, plantilla, respuesta, add_eos)
+
+    # Se escribe en un directorio temporal y se renombra, para no dejar entradas a medias
+    temporal = f"{destino}.tmp-{os.getpid()}"
+    dataset.save_to_disk(temporal)
+    if os.path.isdir(destino):
+        shutil.rmtree(temporal)  # Otro proceso la ha creado mientras tanto
+    else:
+        os.replace(temporal, destino)
+    print(f"Dataset tokenizado y guardado en caché: {destino}")
+    return load_from_disk(destino)
+
+
+def cargar_tarea(path: str, tokenizer, tarea: str, con_respuesta: bool = True):
+    """cargar_tokenizado con las plantillas de plantillas.py (prompt + respuesta + EOS para entrenar)."""
+    plantilla = PLANTILLAS[tarea]
+    if con_respuesta:
+        return cargar_tokenizado(path, tokenizer, plantilla["prompt"], plantilla["respuesta"], add_eos=True)
+    return cargar_tokenizado(path, tokenizer, plantilla["prompt"])
@@ -0,0 +1,174 @@
+import time
+import torch
+from transformers import LogitsProcessor
+
+# --- PLANTILLAS DE SALIDA ---
+# Cada posición es el conjunto de caracteres permitidos en ese punto de la salida, o un dict
+# {carácter anterior: caracteres permitidos} cuando el dígito depende del anterior (mes, día, hora).
+D = "0123456789"
+MES = {"0": "123456789", "1": "012"} # 01-12
+DIA = {"0": "123456789", "1": D, "2": D, "3": "01"} # 01-31
+HORA = {"0": D, "1": D, "2": "0123"} # 00-23
+
+# YYYY-MM-DD HH:MM (formato TLP de local_api_server.py)
+PLANTILLA_FECHA_HORA = [D, D, D, D, "-", "01", MES, "-", "0123", DIA, " ", "012", HORA, ":", "012345", D]
+
+# HH:MM (formato de la tarea hora-texto de test.py)
+PLANTILLA_HORA = ["012", HORA, ":", "012345", D]
+
+# (plantilla, salida, ¿es prefijo válido?) comprobados con ProcesadorFormato en comprobar_casos()
+CASOS_REGRESION = [
+    (PLANTILLA_FECHA_HORA, "2025-01-07 09:30", True),
+    (PLANTILLA_FECHA_HORA, "2025-12-31 23:59", True),
+    (PLANTILLA_FECHA_HORA, "2025-00", False),
+    (PLANTILLA_FECHA_HORA, "2025-13", False),
+    (PLANTILLA_FECHA_HORA, "2025-19", False),
+    (PLANTILLA_FECHA_HORA, "2025-01-00", False),
+    (PLANTILLA_FECHA_HORA, "2025-01-32", False),
+    (PLANTILLA_FECHA_HORA, "2025-01-39", False),
+    (PLANTILLA_FECHA_HORA, "2025-01-07 24", False),
+    (PLANTILLA_FECHA_HORA, "2025-01-07 29", False),
+    (PLANTILLA_FECHA_HORA, "2025-01-07 09:60", False),
+    (PLANTILLA_HORA, "23:45", True),
+    (PLANTILLA_HORA, "00:00", True),
+    (PLANTILLA_HORA, "24", False),
+]
+
+# Caracteres candidatos por tokenizer (se calcula una sola vez: recorrer el vocabulario es caro)
+_candidatos_por_tokenizer = {}
+
+
+def _caracteres(posicion) -> str:
+    """Todos los caracteres que puede tener una posición de la plantilla."""
+    return "".join(posicion.values()) if isinstance(posicion, dict) else posicion
+
+
+def _candidatos(tokenizador, plantilla):
+    """Tokens cuyo texto sólo usa caracteres que pueden aparecer en la plantilla (o el espacio inicial)."""
+    alfabeto = set("".join(_caracteres(posicion) for posicion in plantilla)) | {" "}
+    clave = (id(tokenizador), frozenset(alfabeto))
+    if clave not in _candidatos_por_tokenizer:
+        candidatos = {}
+        for token_id in range(len(tokenizador)):
+            texto = tokenizador.decode([token_id])
+            if texto and set(texto) <= alfabeto:
+                candidatos[token_id] = texto
+        _candidatos_por_tokenizer[clave] = candidatos
+    return _candidatos_por_tokenizer[clave]
+
+
+def _es_prefijo_valido(texto: str, plantilla) -> bool:
+    """Comprueba que el texto (con un espacio inicial opcional) es un prefijo de la plantilla."""
+    if texto.startswith(" "):
+        texto = texto[1:]
+    if len(texto) > len(plantilla):
+        return False
+    for i, (caracter, permitidos) in enumerate(zip(texto, plantilla)):
+        if isinstance(permitidos, dict):
+            permitidos = permitidos.get(texto[i - 1], "")
+        if caracter not in permitidos:
+            return False
+    return True
+
+
+def max_new_tokens_para(plantilla) -> int:
+    """Tokens de generación necesarios: un carácter por token, el espacio inicial y el EOS."""
+    return len(plantilla) + 2
+
+
+class ProcesadorFormato(LogitsProcessor):
+    """
+    Logits processor que sólo permite tokens que mantienen la salida como prefijo de la plantilla
+    y fuerza el EOS en cuanto la plantilla está completa, así la salida siempre se puede parsear.
+    """
+
+    def __init__(self, tokenizador, plantilla, prompt_len: int):
+        self.plantilla = plantilla
+        self.prompt_len = prompt_len
+        self.eos_token_id = tokenizador.eos_token_id
+        self.candidatos = _candidatos(tokenizador, plantilla)
+
+    def _permitidos(self, generados):
+        """Ids de token permitidos para una fila, dado lo que ya ha generado."""
+        partes = []
+        for token_id in generados:
+            texto = self.candidatos.get(token_id)
+            if texto is None:
+                # La fila ya emitió EOS/padding: sólo puede seguir rellenando con EOS
+                return [self.eos_token_id]
+            partes.append(texto)
+        actual = "".join(partes)
+
+        if len(actual.lstrip(" ")) >= len(self.plantilla):
+            return [self.eos_token_id]
+        permitidos = [token_id for token_id, texto in self.candidatos.items()
+                      if _es_prefijo_valido(actual + texto, self.plantilla)]
+        return permitidos or [self.eos_token_id]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        mascara = torch.full_like(scores, float("-inf"))
+        for fila, ids in enumerate(input_ids[:, self.prompt_len:].tolist()):
+            mascara[fila, self._permitidos(ids)] = 0
+        return scores + mascara
+
+
+class MarcaPrimerToken(LogitsProcessor):
+    """
+    No modifica los logits: anota cuándo llegan los primeros (fin del prefill) para poder
+    separar el tiempo de prefill del de decodificación dentro de model.generate.
+    """
+
+    def __init__(self):
+        self.primer_token = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.primer_token is None:
+            self.primer_token = time.perf_counter()
+        return scores
+
+
+class _TokenizadorCaracteres:
+    """Tokenizer mínimo de un carácter por token (dígitos, '-', ':' y espacio) para comprobar_casos()."""
+
+    def __init__(self):
+        self.vocabulario = list(D + "-: ") + ["<eos>"]
+        self.eos_token_id = len(self.vocabulario) - 1
+
+    def __len__(self):
+        return len(self.vocabulario)
+
+    def decode(self, token_ids):
+        return "".join(self.vocabulario[token_id] for token_id in token_ids)
+
+
+def comprobar_casos():
+    """
+    Comprueba CASOS_REGRESION generando cada salida carácter a carácter con ProcesadorFormato:
+    una salida es válida si todos sus caracteres están permitidos y, completa la plantilla, sólo queda el EOS.
+    Devuelve la lista de fallos (salida, esperado, obtenido).
+    """
+    tokenizador = _TokenizadorCaracteres()
+    fallos = []
+    for plantilla, salida, esperado in CASOS_REGRESION:
+        procesador = ProcesadorFormato(tokenizador, plantilla, prompt_len=0)
+        generados, obtenido = [], True
+        for caracter in salida:
+            token_id = tokenizador.vocabulario.index(caracter)
+            if token_id not in procesador._permitidos(generados):
+                obtenido = False
+                break
+            generados.append(token_id)
+        if obtenido and len(salida) == len(plantilla):
+            obtenido = procesador._permitidos(generados) == [tokenizador.eos_token_id]
+        if obtenido != esperado:
+            fallos.append((salida, esperado, obtenido))
+    return fallos
+
+
+if __name__ == "__main__":
+    fallos = comprobar_casos()
+    for salida, esperado, obtenido in fallos:
+        print(f"FALLO {salida!r}: esperado {esperado}, obtenido {obtenido}")
+    print(f"{len(CASOS_REGRESION) - len(fallos)}/{len(CASOS_REGRESION)} casos de regresión correctos.")
+    if fallos:
+        raise SystemExit(1)
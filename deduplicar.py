@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import unicodedata
+from collections import Counter, defaultdict
+import numpy as np
+from transformers import AutoTokenizer
+from plantillas import formatear_prompt, formatear_respuesta, tarea_de
+
+# Deduplicación en streaming de datasets de entrenamiento (JSONL) antes de tokenizar.
+# - Duplicados exactos: hash del texto normalizado (prompt + respuesta de plantillas.py).
+# - Casi duplicados: MinHash de n-gramas de caracteres con índice LSH por bandas. Sólo se comparan filas
+#   con la misma respuesta: "las ocho y cinco" y "las ocho y seis" se parecen mucho pero no son la misma fila.
+# - Solape train/test: las filas de entrenamiento que coinciden (exacta o casi) con el test se descartan.
+# Se conserva la primera aparición de cada fila y el orden del fichero de entrada.
+ENTRADA = "datos_horas_v3.jsonl"
+TEST_FILE = "datos_horas_test_random.jsonl"
+MODEL_ID = "Qwen/Qwen1.5-1.8B-Chat"   # Tokenizer para contar los tokens ahorrados
+
+UMBRAL_JACCARD = 0.7     # Similitud (estimada por MinHash) a partir de la cual dos filas son casi duplicadas
+TAMANO_SHINGLE = 5       # n-gramas de caracteres del texto normalizado
+NUM_PERMUTACIONES = 64
+BANDAS = 16              # 16 bandas de 4 filas: son candidatas las parejas con Jaccard desde ~0.5
+SEMILLA_MINHASH = 1
+LOTE_TOKENIZACION = 1000
+
+# Permutaciones de MinHash: h(x) = (a * x + b) mod (2^61 - 1), truncado a 32 bits
+_PRIMO = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(SEMILLA_MINHASH)
+_A = _rng.integers(1, _PRIMO, size=NUM_PERMUTACIONES, dtype=np.uint64)
+_B = _rng.integers(0, _PRIMO, size=NUM_PERMUTACIONES, dtype=np.uint64)
+_FILAS_BANDA = NUM_PERMUTACIONES // BANDAS
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin tildes, sin puntuación (salvo ':' de las horas) y con espacios colapsados."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w:]+", " ", texto).split())
+
+
+def _hash64(texto: str) -> int:
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def firma_minhash(texto: str) -> np.ndarray:
+    """Firma MinHash (NUM_PERMUTACIONES x uint32) de los n-gramas de caracteres del texto."""
+    n = TAMANO_SHINGLE
+    shingles = {texto[i:i + n] for i in range(max(1, len(texto) - n + 1))}
+    hashes = np.fromiter((_hash64(s) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # El producto desborda a propósito (aritmética módulo 2^64, como datasketch)
+    with np.errstate(over="ignore"):
+        permutados = (np.outer(hashes, _A) + _B) % _PRIMO
+    return (permutados & np.uint64(0xFFFFFFFF)).min(axis=0).astype(np.uint32)
+
+
+def nuevo_indice():
+    """Índice de filas vistas: huellas exactas y, por (respuesta, banda), las firmas MinHash."""
+    return {"huellas": set(), "bandas": defaultdict(list), "firmas": []}
+
+
+def _claves_bandas(respuesta, firma):
+    return [(respuesta, banda, firma[banda * _FILAS_BANDA:(banda + 1) * _FILAS_BANDA].tobytes())
+            for banda in range(BANDAS)]
+
+
+def buscar(indice, huella, respuesta, firma, umbral=UMBRAL_JACCARD):
+    """'exacto', 'casi' o None según la fila (ya normalizada) esté en el índice."""
+    if huella in indice["huellas"]:
+        return "exacto"
+    if firma is None:
+        return None
+    candidatos = {i for clave in _claves_bandas(respuesta, firma) for i in indice["bandas"].get(clave, ())}
+    for i in candidatos:
+        if np.mean(indice["firmas"][i] == firma) >= umbral:
+            return "casi"
+    return None
+
+
+def anadir(indice, huella, respuesta, firma):
+    indice["huellas"].add(huella)
+    if firma is None:
+        return
+    indice["firmas"].append(firma)
+    for clave in _claves_bandas(respuesta, firma):
+        indice["bandas"][clave].append(len(indice["firmas"]) - 1)
+
+
+def claves_fila(fila, casi_duplicados=True):
+    """(texto de entrenamiento, huella exacta, respuesta normalizada, firma MinHash o None) de una fila."""
+    tarea = tarea_de(fila)
+    prompt = formatear_prompt(tarea, **fila)
+    respuesta = formatear_respuesta(tarea, **fila)
+    prompt_norm, respuesta_norm = normalizar(prompt), normalizar(respuesta)
+    huella = hashlib.blake2b(f"{prompt_norm}\0{respuesta_norm}".encode("utf-8"), digest_size=16).digest()
+    firma = firma_minhash(prompt_norm) if casi_duplicados else None
+    return prompt + respuesta, huella, respuesta_norm, firma
+
+
+def indice_de_fichero(path, casi_duplicados=True):
+    """Índice con todas las filas de un JSONL (el conjunto de test)."""
+    indice = nuevo_indice()
+    with open(path, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                _, huella, respuesta, firma = claves_fila(json.loads(linea), casi_duplicados)
+                anadir(indice, huella, respuesta, firma)
+    return indice
+
+
+def deduplicar(entrada=ENTRADA, salida=None, test_file=TEST_FILE, tokenizer=None,
+               umbral=UMBRAL_JACCARD, casi_duplicados=True):
+    """
+    Escribe en 'salida' las filas de 'entrada' sin duplicados, casi duplicados ni solapes con el test.
+    Devuelve el informe con los contadores y, si se pasa el tokenizer, los tokens de entrenamiento ahorrados.
+    """
+    salida = salida or f"{os.path.splitext(entrada)[0]}_dedup.jsonl"
+    indice_test = indice_de_fichero(test_file, casi_duplicados) if test_file and os.path.exists(test_file) else None
+    indice = nuevo_indice()
+    contadores = Counter()
+    tokens = Counter()
+    pendientes = {"conservadas": [], "descartadas": []}
+
+    def contar_tokens(destino, forzar=False):
+        # Mismo texto que se entrena (prompt + respuesta + EOS), tokenizado por lotes
+        textos = pendientes[destino]
+        if tokenizer is not None and textos and (forzar or len(textos) >= LOTE_TOKENIZACION):
+            tokens[destino] += sum(map(len, tokenizer([t + tokenizer.eos_token for t in textos])["input_ids"]))
+        if forzar or len(textos) >= LOTE_TOKENIZACION:
+            textos.clear()
+
+    temporal = f"{salida}.tmp"
+    with open(entrada, encoding='utf-8') as f, open(temporal, 'w', encoding='utf-8') as out:
+        for linea in f:
+            if not linea.strip():
+                continue
+            contadores["filas_entrada"] += 1
+            texto, huella, respuesta, firma = claves_fila(json.loads(linea), casi_duplicados)
+
+            motivo = None
+            if indice_test is not None:
+                coincidencia = buscar(indice_test, huella, respuesta, firma, umbral)
+                motivo = f"solape_test_{coincidencia}" if coincidencia else None
+            if motivo is None:
+                coincidencia = buscar(indice, huella, respuesta, firma, umbral)
+                motivo = {"exacto": "duplicado_exacto", "casi": "casi_duplicado"}.get(coincidencia)
+
+            if motivo is None:
+                anadir(indice, huella, respuesta, firma)
+                out.write(linea if linea.endswith('\n') else linea + '\n')
+                contadores["filas_salida"] += 1
+                destino = "conservadas"
+            else:
+                contadores[motivo] += 1
+                destino = "descartadas"
+            pendientes[destino].append(texto)
+            contar_tokens(destino)
+    os.replace(temporal, salida)
+    for destino in pendientes:
+        contar_tokens(destino, forzar=True)
+
+    informe = {"entrada": entrada, "salida": salida, "test": test_file if indice_test is not None else None,
+               "umbral_jaccard": umbral if casi_duplicados else None,
+               **{clave: contadores[clave] for clave in ("filas_entrada", "filas_salida", "duplicado_exacto",
+                                                          "casi_duplicado", "solape_test_exacto", "solape_test_casi")}}
+    if tokenizer is not None:
+        total = tokens["conservadas"] + tokens["descartadas"]
+        informe.update(tokens_entrada=total, tokens_salida=tokens["conservadas"],
+                       tokens_ahorrados_por_epoca=tokens["descartadas"],
+                       porcentaje_ahorrado=round(100 * tokens["descartadas"] / total, 2) if total else 0.0)
+    return informe
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Elimina duplicados, casi duplicados y solapes con el test de un JSONL.")
+    parser.add_argument("entrada", nargs="?", default=ENTRADA)
+    parser.add_argument("--salida", default=None, help="JSONL deduplicado (por defecto <entrada>_dedup.jsonl).")
+    parser.add_argument("--test", default=TEST_FILE, help="JSONL de test contra el que se comprueba el solape ('' = ninguno).")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_JACCARD, help="Jaccard mínimo para casi duplicados.")
+    parser.add_argument("--solo-exactos", action="store_true", help="No busca casi duplicados (sin MinHash).")
+    parser.add_argument("--tokenizer", default=MODEL_ID, help="Tokenizer para contar los tokens ahorrados ('' = no contar).")
+    parser.add_argument("--informe", default=None, help="Guarda el informe en este fichero JSON.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer) if args.tokenizer else None
+    informe = deduplicar(args.entrada, args.salida, args.test, tokenizer, args.umbral, not args.solo_exactos)
+    print(json.dumps(informe, ensure_ascii=False, indent=2))
+    if args.informe:
+        with open(args.informe, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import argparse
+import torch
+from transformers import AutoModelForCausalLM, DynamicCache
+import local_api_server as core # Mismos prompts, prefijo y generate_batch que la API
+
+# Exportación del modelo fusionado a ONNX para servirlo con ONNX Runtime en CPU
+# (local_api_server.py --cpu-backend onnx / onnx_int8).
+# El KV cache va como entradas y salidas explícitas del grafo, así un único grafo sirve para el prefill
+# (con pasado de longitud 0 o con el KV del prefijo) y para cada paso de la decodificación:
+#   entradas: input_ids, attention_mask (pasado + nuevos), position_ids, pasado.<capa>.{clave,valor}
+#   salidas:  logits (sólo del último token), presente.<capa>.{clave,valor}
+MODEL_PATH = "qwen_hora_fusionado"
+VERIFY_DATASET_FILE = "datos_horas_tlp_v4.jsonl"
+VERIFY_EJEMPLOS = 64
+OPSET = 18
+
+
+class DecoderConKV(torch.nn.Module):
+    """Envuelve el modelo causal con el KV cache aplanado en tensores (un par clave/valor por capa)."""
+
+    def __init__(self, modelo):
+        super().__init__()
+        self.modelo = modelo
+        self.num_capas = modelo.config.num_hidden_layers
+
+    def forward(self, input_ids, attention_mask, position_ids, *pasado):
+        cache = DynamicCache(config=self.modelo.config)
+        for capa in range(self.num_capas):
+            cache.update(pasado[2 * capa], pasado[2 * capa + 1], capa)
+        salida = self.modelo(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                             past_key_values=cache, use_cache=True)
+        presente = [tensor for capa in cache.layers for tensor in (capa.keys, capa.values)]
+        return (salida.logits[:, -1, :], *presente)
+
+
+def _nombres_kv(prefijo, num_capas):
+    return [f"{prefijo}.{capa}.{parte}" for capa in range(num_capas) for parte in ("clave", "valor")]
+
+
+def exportar(model_path=MODEL_PATH, destino=None):
+    """Exporta model_path a ONNX (float32) con ejes dinámicos de batch, secuencia y longitud del pasado."""
+    destino = destino or os.path.join(model_path, core.MODELOS_ONNX["onnx"])
+    modelo = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32, device_map="cpu")
+    modelo.eval()
+    config = modelo.config
+    num_capas = config.num_hidden_layers
+    cabezas_kv = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+    dim_cabeza = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+
+    # Ejemplo de trazado: batch 2, 3 tokens nuevos sobre 2 de pasado (los tamaños no deben coincidir)
+    batch, nuevos, previos = 2, 3, 2
+    ejemplo = (
+        torch.randint(0, config.vocab_size, (batch, nuevos)),
+        torch.ones(batch, previos + nuevos, dtype=torch.long),
+        torch.arange(previos, previos + nuevos).repeat(batch, 1),
+        *[torch.zeros(batch, cabezas_kv, previos, dim_cabeza) for _ in range(2 * num_capas)],
+    )
+    dim_batch, dim_secuencia = torch.export.Dim("batch"), torch.export.Dim("secuencia")
+    dim_pasado, dim_total = torch.export.Dim("pasado"), torch.export.Dim("total")
+    ejes = {
+        "input_ids": {0: dim_batch, 1: dim_secuencia},
+        "attention_mask": {0: dim_batch, 1: dim_total},
+        "position_ids": {0: dim_batch, 1: dim_secuencia},
+        "pasado": tuple({0: dim_batch, 2: dim_pasado} for _ in range(2 * num_capas)),
+    }
+
+    inicio = time.perf_counter()
+    with torch.no_grad():
+        programa = torch.onnx.export(
+            DecoderConKV(modelo), ejemplo, dynamo=True, dynamic_shapes=ejes, opset_version=OPSET,
+            input_names=["input_ids", "attention_mask", "position_ids", *_nombres_kv("pasado", num_capas)],
+            output_names=["logits", *_nombres_kv("presente", num_capas)],
+        )
+    # Los pesos van a un fichero .data aparte (los modelos de más de 2 GB no caben en un protobuf)
+    programa.save(destino, external_data=True)
+    print(f"Modelo ONNX guardado en {destino} ({num_capas} capas, {time.perf_counter() - inicio:.0f}s)")
+    return destino
+
+
+def exportar_int8(model_path=MODEL_PATH):
+    """Cuantización dinámica int8 de los pesos de MatMul del modelo ONNX (como la variante int8 de torch)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    origen = os.path.join(model_path, core.MODELOS_ONNX["onnx"])
+    destino = os.path.join(model_path, core.MODELOS_ONNX["onnx_int8"])
+    quantize_dynamic(origen, destino, weight_type=QuantType.QInt8, use_external_data_format=True)
+    print(f"Variante ONNX int8 guardada en {destino}")
+    return destino
+
+
+def _ejemplos_de_verificacion(dataset_file, num_ejemplos):
+    filas = []
+    with open(dataset_file, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                filas.append(json.loads(linea))
+                if len(filas) == num_ejemplos:
+                    break
+    return filas
+
+
+def _generar_con_backend(backend, prompts, model_path):
+    """Salidas de generate_batch (lotes de BATCH_MAX_SIZE) con un backend de CPU y su tiempo total."""
+    core.FUSED_MODEL_PATH = model_path
+    core.CPU_BACKEND = backend
+    core.load_model()
+    core.generate_batch(prompts[:1]) # Calentamiento
+    inicio = time.perf_counter()
+    textos = []
+    for i in range(0, len(prompts), core.BATCH_MAX_SIZE):
+        textos.extend(core.generate_batch(prompts[i:i + core.BATCH_MAX_SIZE]))
+    duracion = time.perf_counter() - inicio
+    core.model = None
+    return textos, duracion
+
+
+def verificar(model_path=MODEL_PATH, dataset_file=VERIFY_DATASET_FILE, num_ejemplos=VERIFY_EJEMPLOS, int8=False):
+    """
+    Paridad con el camino de PyTorch en el test TLP: mismas peticiones por generate_batch (mismo prefijo,
+    plantilla restringida y lotes) con el backend float32 y con los backends ONNX.
+    El ONNX float32 debe coincidir en todas las salidas; el int8 es aproximado y sólo se informa.
+    """
+    filas = _ejemplos_de_verificacion(dataset_file, num_ejemplos)
+    prompts = [core.build_prompt(fila['peticion'], fila['contexto_base']) for fila in filas]
+    esperadas = [fila['salida_absoluta'].strip() for fila in filas]
+
+    backends = ["float32", "onnx"] + (["onnx_int8"] if int8 else [])
+    textos = {}
+    correcto = True
+    for backend in backends:
+        textos[backend], duracion = _generar_con_backend(backend, prompts, model_path)
+        aciertos = sum(core.extract_salida(texto) == esperada for texto, esperada in zip(textos[backend], esperadas))
+        informe = f"{backend}: precisión {aciertos}/{len(prompts)}, {duracion / len(prompts) * 1000:.1f} ms/petición"
+        if backend != "float32":
+            # Se compara el texto generado completo, no sólo la fecha extraída
+            iguales = sum(a == b for a, b in zip(textos[backend], textos["float32"]))
+            informe += f", {iguales}/{len(prompts)} salidas idénticas a PyTorch"
+            if backend == "onnx" and iguales != len(prompts):
+                correcto = False
+                for fila, salida, esperada in zip(filas, textos[backend], textos["float32"]):
+                    if salida != esperada:
+                        print(f"  {fila['peticion']!r} ({fila['contexto_base']}): {salida!r} != {esperada!r}")
+        print(f"Verificación {informe}")
+    return correcto
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Exporta el modelo fusionado a ONNX (con KV cache) para ONNX Runtime.")
+    parser.add_argument("--modelo", default=MODEL_PATH, help="Directorio del modelo fusionado.")
+    parser.add_argument("--int8", action="store_true",
+                        help=f"Genera también {core.MODELOS_ONNX['onnx_int8']} (cuantización dinámica int8).")
+    parser.add_argument("--verificar", type=int, default=0, metavar="N",
+                        help="Compara con el backend de PyTorch en N ejemplos del test TLP.")
+    parser.add_argument("--dataset", default=VERIFY_DATASET_FILE, help="JSONL TLP para la verificación.")
+    parser.add_argument("--solo-verificar", action="store_true", help="No exporta: verifica los ONNX existentes.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.solo_verificar:
+        exportar(args.modelo)
+        if args.int8:
+            exportar_int8(args.modelo)
+    if (args.verificar or args.solo_verificar) and not verificar(
+            args.modelo, args.dataset, args.verificar or VERIFY_EJEMPLOS, args.int8):
+        raise SystemExit("La verificación ha fallado: el modelo ONNX no reproduce al de PyTorch.")
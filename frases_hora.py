@@ -0,0 +1,237 @@
+import json
+from itertools import product
+import numpy as np
+
+# Tablas de frases de hora compartidas por los generadores de datasets (train/test) y las reglas del servidor.
+# Se construyen una sola vez al importar: para cada uno de los 1440 minutos del día y cada esquema de frases,
+# la lista de "formas" (una fila del dataset por forma) y, para cada forma, todas sus variantes de superficie
+# (preposición y momento del día). Generar una fila es sólo elegir un índice, y se puede hacer en bloque con NumPy.
+# Los textos se guardan también ya escapados para JSON: las líneas JSONL se arman concatenando, sin json.dumps.
+MINUTOS_DIA = 24 * 60
+
+DIAS_SEMANA_ES = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+
+# Modificadores de día de las peticiones TLP; "el <día>" depende del día de la semana del contexto
+MODIFICADORES_DIA = ["mañana", "pasado mañana"] + [f"el {dia}" for dia in DIAS_SEMANA_ES]
+
+# DIAS_HASTA[modificador][día de la semana del contexto] -> días de desplazamiento (1..7)
+DIAS_HASTA = {"mañana": [1] * 7, "pasado mañana": [2] * 7}
+for _objetivo, _dia in enumerate(DIAS_SEMANA_ES):
+    DIAS_HASTA[f"el {_dia}"] = [(_objetivo - _actual) % 7 or 7 for _actual in range(7)]
+
+
+def number_to_spanish(n):
+    """Convierte números del 0 al 59 a texto."""
+    if not (0 <= n <= 59):
+        return str(n)
+    unidades = ["", "uno", "dos", "tres", "cuatro", "cinco", "seis", "siete", "ocho", "nueve"]
+    dieces = ["diez", "once", "doce", "trece", "catorce", "quince"]
+
+    if n == 0: return "cero"
+    if n <= 9: return unidades[n]
+    if n <= 15: return dieces[n - 10]
+    if n <= 19: return "dieci" + unidades[n % 10]
+    if n == 20: return "veinte"
+    if n <= 29: return "veinti" + unidades[n % 10]
+
+    decena = ["", "", "", "treinta", "cuarenta", "cincuenta"][n // 10]
+    return f"{decena} y {unidades[n % 10]}" if n % 10 != 0 else decena
+
+
+NUMEROS = [number_to_spanish(n) for n in range(60)]
+
+# "HH:MM" de cada minuto del día (salida de la tarea hora-texto)
+HORAS_DIGITALES = [f"{minuto // 60:02d}:{minuto % 60:02d}" for minuto in range(MINUTOS_DIA)]
+
+
+def hora_12(h_24):
+    """Hora en formato 12h (12 para las 00 y las 12)."""
+    return h_24 % 12 or 12
+
+
+# --- MOMENTOS DEL DÍA ---
+
+def _momento_tlp(h_24):
+    if 6 <= h_24 < 12:
+        return ("de la mañana",)
+    if 12 <= h_24 < 20:
+        return ("de la tarde",)
+    return ("de la noche",)
+
+
+def _momentos_simple(h_24):
+    if 6 <= h_24 < 12:
+        return ("de la mañana", "a.m.")
+    if 12 <= h_24 < 20:
+        return ("de la tarde", "p.m.", "del mediodía")
+    return ("de la noche", "a.m.")
+
+
+FRANJAS_DIA = {
+    (0, 5): ("de la madrugada", "a.m."),
+    (6, 11): ("de la mañana", "a.m."),
+    (12, 16): ("del mediodía", "de la tarde", "p.m."),
+    (17, 23): ("de la tarde", "de la noche", "p.m."),
+}
+
+
+def _momentos_franjas(h_24):
+    for (inicio, fin), momentos in FRANJAS_DIA.items():
+        if inicio <= h_24 <= fin:
+            return momentos
+
+
+# --- FORMAS POR ESQUEMA ---
+# Cada función devuelve, para HH:MM, una tupla de variantes por forma.
+
+def _variantes(plantilla, **opciones):
+    """Todas las combinaciones de las opciones sobre la plantilla."""
+    claves = list(opciones)
+    return tuple(plantilla.format(**dict(zip(claves, combinacion))) for combinacion in product(*opciones.values()))
+
+
+def texto_hora_tlp(h_24, m):
+    """Hora en texto de las peticiones TLP ("ocho y media de la tarde"): una sola forma por minuto."""
+    h_text = NUMEROS[hora_12(h_24)]
+    momento = _momento_tlp(h_24)[0]
+    if m == 0:
+        return f"{h_text} en punto {momento}"
+    if m == 30:
+        return f"{h_text} y media {momento}"
+    if m == 15:
+        return f"{h_text} y cuarto {momento}"
+    if m == 45:
+        return f"{NUMEROS[hora_12(h_24 + 1)]} menos cuarto {momento}"
+    return f"{h_text} y {NUMEROS[m]} {momento}"
+
+
+def _formas_tlp(h_24, m):
+    return [(texto_hora_tlp(h_24, m),)]
+
+
+def _formas_v1(h_24, m):
+    """generate_dataset.py y generate_dataset_text.py: una forma 12h, otra numérica y otra 24h."""
+    y, menos = ("y", "con"), ("menos",)
+    h_text, h_next_text = NUMEROS[hora_12(h_24)], NUMEROS[hora_12(h_24 + 1)]
+    momentos = _momentos_simple(h_24)
+    formas = []
+    if m == 0:
+        formas.append(_variantes(f"las {h_text} en punto {{momento}}", momento=momentos))
+    elif m == 30:
+        formas.append(_variantes(f"las {h_text} {{y}} media {{momento}}", y=y, momento=momentos))
+    elif m == 15:
+        formas.append(_variantes(f"las {h_text} {{y}} cuarto {{momento}}", y=y, momento=momentos))
+    elif m == 45:
+        formas.append(_variantes(f"las {h_next_text} menos cuarto {{momento}}", momento=momentos))
+    elif 1 < m < 30:
+        formas.append(_variantes(f"las {h_text} {{y}} {NUMEROS[m]} {{momento}}", y=y, momento=momentos))
+    elif 30 < m < 60:
+        formas.append(_variantes(f"las {h_next_text} {{menos}} {NUMEROS[60 - m]} {{momento}}",
+                                 menos=menos, momento=momentos))
+    formas.append(_variantes(f"las {h_text} {{y}} {NUMEROS[m]} {{momento}}", y=y, momento=momentos))
+    formas.append((f"{NUMEROS[h_24]} horas y {NUMEROS[m]} minutos",))
+    return formas
+
+
+def _formas_franjas(h_24, m, preposiciones_y, extra):
+    """
+    generate_dataset_train2-py (extra="minutos") y dataset3.py (extra="cero"): 'y', 'menos',
+    formas especiales y 24h, con el momento del día por franjas.
+    """
+    menos = ("menos", "para las")
+    h_text, h_next_text = NUMEROS[hora_12(h_24)], NUMEROS[hora_12(h_24 + 1)]
+    momentos, momentos_next = _momentos_franjas(h_24), _momentos_franjas((h_24 + 1) % 24)
+    formas = []
+    if m != 0:
+        formas.append(_variantes(f"las {h_text} {{y}} {NUMEROS[m]} {{momento}}", y=preposiciones_y, momento=momentos))
+        if extra == "cero" and m < 10:
+            formas.append(_variantes(f"las {h_text} {{y}} cero {NUMEROS[m]} minutos {{momento}}",
+                                     y=preposiciones_y, momento=momentos))
+        if extra == "minutos" and m % 10 == 0 and m > 10:
+            formas.append(_variantes(f"las {h_text} {{y}} {NUMEROS[m]} minutos {{momento}}",
+                                     y=preposiciones_y, momento=momentos))
+    if m > 30:
+        formas.append(_variantes(f"las {h_next_text} {{menos}} {NUMEROS[60 - m]} {{momento}}",
+                                 menos=menos, momento=momentos_next))
+    if m == 0:
+        formas.append(_variantes(f"las {h_text} en punto {{momento}}", momento=momentos))
+        formas.append(_variantes(f"las {h_text} {{momento}}", momento=momentos))
+    elif m == 30:
+        formas.append(_variantes(f"las {h_text} y media {{momento}}", momento=momentos))
+    elif m == 15:
+        formas.append(_variantes(f"las {h_text} y cuarto {{momento}}", momento=momentos))
+    elif m == 45:
+        formas.append(_variantes(f"las {h_next_text} menos cuarto {{momento}}", momento=momentos_next))
+    formas.append((f"{NUMEROS[h_24]} horas y {NUMEROS[m]} minutos",))
+    return formas
+
+
+ESQUEMAS = {
+    "tlp": _formas_tlp,
+    "v1": _formas_v1,
+    "v2": lambda h_24, m: _formas_franjas(h_24, m, ("y", "con"), "minutos"),
+    "v3": lambda h_24, m: _formas_franjas(h_24, m, ("y", "con", "pasadas las"), "cero"),
+}
+
+
+def _json(texto):
+    """Texto escapado como cadena JSON, sin las comillas (json.dumps escapa carácter a carácter)."""
+    return json.dumps(texto, ensure_ascii=False)[1:-1]
+
+
+def _construir_tabla(formas_de):
+    """
+    Tabla compacta de un esquema: 'textos' con todas las variantes seguidas; la forma f ocupa
+    textos[inicio[f]:inicio[f] + tamano[f]] y las formas del minuto i son ranuras[i]:ranuras[i + 1].
+    'textos_json' son los mismos textos escapados para JSON.
+    """
+    textos, inicio, tamano, ranuras = [], [], [], [0]
+    for minuto in range(MINUTOS_DIA):
+        for variantes in formas_de(minuto // 60, minuto % 60):
+            inicio.append(len(textos))
+            tamano.append(len(variantes))
+            textos.extend(variantes)
+        ranuras.append(len(inicio))
+    return {
+        "textos": textos,
+        "textos_json": [_json(texto) for texto in textos],
+        "inicio": np.array(inicio, dtype=np.int64),
+        "tamano": np.array(tamano, dtype=np.int64),
+        "ranuras": np.array(ranuras, dtype=np.int64),
+    }
+
+
+TABLAS = {esquema: _construir_tabla(formas_de) for esquema, formas_de in ESQUEMAS.items()}
+
+# Hora en texto TLP por minuto del día (el esquema "tlp" tiene una sola forma y variante por minuto)
+FRASES_TLP = TABLAS["tlp"]["textos"]
+
+
+# --- MUESTREO ---
+
+def muestrear(esquema, minutos, rng):
+    """
+    Para cada minuto del array 'minutos' (0..1439) elige al azar una variante de cada una de sus formas.
+    Devuelve dos arrays alineados: el minuto de cada fila y el índice de su texto en TABLAS[esquema]['textos'].
+    """
+    tabla = TABLAS[esquema]
+    minutos = np.asarray(minutos, dtype=np.int64)
+    primeras = tabla["ranuras"][minutos]
+    cuentas = tabla["ranuras"][minutos + 1] - primeras
+    # Índice de cada forma: primera forma de su minuto + posición dentro del minuto
+    posicion = np.arange(cuentas.sum()) - np.repeat(np.cumsum(cuentas) - cuentas, cuentas)
+    formas = np.repeat(primeras, cuentas) + posicion
+    return np.repeat(minutos, cuentas), tabla["inicio"][formas] + rng.integers(0, tabla["tamano"][formas])
+
+
+def lineas_hora(esquema, minutos, prefijos, rng):
+    """
+    Líneas JSONL {"instruction", "output"} de la tarea hora-texto: prefijo al azar + una variante por forma.
+    Cada línea es idéntica a json.dumps(fila, ensure_ascii=False) + '\n'.
+    """
+    filas_minuto, indices = muestrear(esquema, minutos, rng)
+    textos = TABLAS[esquema]["textos_json"]
+    prefijos = [_json(prefijo) for prefijo in prefijos]
+    indices_prefijo = rng.integers(0, len(prefijos), size=len(indices))
+    return [f'{{"instruction": "{prefijos[p]}{textos[t]}", "output": "{HORAS_DIGITALES[minuto]}"}}\n'
+            for minuto, t, p in zip(filas_minuto.tolist(), indices.tolist(), indices_prefijo.tolist())]
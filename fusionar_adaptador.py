@@ -0,0 +1,203 @@
+import os
+import json
+import glob
+import shutil
+import argparse
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftModel
+from plantillas import formatear_prompt, tarea_de
+
+# Fusión del adaptador LoRA con el modelo base, shard a shard y fuera del proceso de entrenamiento.
+# Cada .safetensors del modelo base se lee, se le suma B @ A * escala en las capas adaptadas y se
+# escribe antes de pasar al siguiente: el pico de memoria es un shard más el adaptador, no dos modelos.
+ADAPTER_PATH = "qwen_hora_final"
+OUTPUT_PATH = "qwen_hora_fusionado"
+MODELO_INT8_FILE = "modelo_int8.pt" # Variante int8 para CPU (la carga local_api_server.py con CPU_BACKEND="int8")
+VERIFY_DATASET_FILE = "datos_horas_tlp_v4.jsonl"
+VERIFY_EJEMPLOS = 16
+MAX_NEW_TOKENS = 20
+# Tolerancia (rtol, atol) de los logits del fusionado frente a base + adaptador, según el dtype:
+# W + B @ A * escala no redondea igual que W x + B (A x) * escala, así que no se exige igualdad bit a bit
+TOLERANCIA_LOGITS = {torch.float32: (1e-4, 1e-3), torch.float16: (5e-3, 5e-2), torch.bfloat16: (2e-2, 2e-1)}
+
+# Ficheros del modelo base que se copian tal cual (configuración y tokenizer)
+FICHEROS_AUXILIARES = ("*.json", "*.txt", "*.model", "*.tiktoken")
+
+
+def ruta_modelo_base(base):
+    """Directorio local del modelo base; si es un id del Hub, descarga sólo safetensors y configuración."""
+    if os.path.isdir(base):
+        return base
+    from huggingface_hub import snapshot_download
+    return snapshot_download(base, allow_patterns=["*.safetensors", *FICHEROS_AUXILIARES])
+
+
+def cargar_adaptador(adapter_path):
+    """Devuelve ({nombre del peso base: (A, B)}, escala) a partir de adapter_model.safetensors."""
+    with open(os.path.join(adapter_path, "adapter_config.json"), encoding='utf-8') as f:
+        config = json.load(f)
+    if config.get("peft_type") != "LORA" or config.get("use_dora") or config.get("rank_pattern") \
+            or config.get("alpha_pattern") or config.get("modules_to_save") or config.get("fan_in_fan_out"):
+        raise ValueError("Sólo se fusionan adaptadores LoRA simples (sin DoRA, patrones por capa ni modules_to_save).")
+
+    r = config["r"]
+    escala = config["lora_alpha"] / (r ** 0.5 if config.get("use_rslora") else r)
+
+    pesos = load_file(os.path.join(adapter_path, "adapter_model.safetensors"))
+    capas = {}
+    for nombre, tensor in pesos.items():
+        # base_model.model.<nombre del módulo>.lora_A.weight -> <nombre del módulo>.weight
+        for sufijo, indice in ((".lora_A.weight", 0), (".lora_B.weight", 1)):
+            if nombre.endswith(sufijo):
+                base = nombre[len("base_model.model."):-len(sufijo)] + ".weight"
+                capas.setdefault(base, [None, None])[indice] = tensor
+    return capas, escala
+
+
+def fusionar(base, adapter_path=ADAPTER_PATH, output_path=OUTPUT_PATH):
+    """Escribe en output_path el modelo base con el adaptador fusionado, un shard cada vez."""
+    ruta_base = ruta_modelo_base(base)
+    capas, escala = cargar_adaptador(adapter_path)
+    shards = sorted(glob.glob(os.path.join(ruta_base, "*.safetensors")))
+    if not shards:
+        raise FileNotFoundError(f"No hay .safetensors en {ruta_base}")
+
+    os.makedirs(output_path, exist_ok=True)
+    pendientes = set(capas)
+    for shard in shards:
+        tensores = {}
+        with safe_open(shard, framework="pt") as f:
+            metadata = f.metadata()
+            for nombre in f.keys():
+                tensor = f.get_tensor(nombre)
+                if nombre in capas:
+                    lora_a, lora_b = capas[nombre]
+                    delta = (lora_b.float() @ lora_a.float()) * escala
+                    tensor = (tensor.float() + delta).to(tensor.dtype)
+                    pendientes.discard(nombre)
+                tensores[nombre] = tensor
+        save_file(tensores, os.path.join(output_path, os.path.basename(shard)), metadata=metadata)
+        print(f"Shard fusionado: {os.path.basename(shard)} ({len(tensores)} tensores)")
+        del tensores
+
+    if pendientes:
+        raise ValueError(f"Capas del adaptador sin peso base correspondiente: {sorted(pendientes)[:5]}")
+
+    # config.json, generation_config.json, índice de shards y tokenizer (los nombres de los pesos no cambian)
+    for patron in FICHEROS_AUXILIARES:
+        for fichero in glob.glob(os.path.join(ruta_base, patron)):
+            shutil.copy(fichero, output_path)
+    print(f"Modelo fusionado guardado en {output_path} ({len(capas)} capas adaptadas, escala {escala})")
+    return ruta_base
+
+
+def exportar_int8(output_path=OUTPUT_PATH):
+    """
+    Variante para CPU: cuantización dinámica int8 de las capas Linear, guardada ya cuantizada para que
+    el servidor no tenga que cargar el modelo en float32 y cuantizarlo en cada arranque.
+    Se guarda el módulo completo (pickle): sólo se debe cargar con la misma versión de torch/transformers.
+    """
+    modelo = AutoModelForCausalLM.from_pretrained(output_path, torch_dtype=torch.float32, device_map="cpu")
+    modelo.eval()
+    modelo = torch.ao.quantization.quantize_dynamic(modelo, {torch.nn.Linear}, dtype=torch.qint8)
+    destino = os.path.join(output_path, MODELO_INT8_FILE)
+    torch.save(modelo, destino)
+    print(f"Variante int8 guardada en {destino} ({os.path.getsize(destino) / 2**20:.0f} MiB)")
+
+
+def _prompts_de_verificacion(dataset_file, num_ejemplos):
+    prompts = []
+    with open(dataset_file, encoding='utf-8') as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            fila = json.loads(linea)
+            prompts.append(formatear_prompt(tarea_de(fila), **fila))
+            if len(prompts) == num_ejemplos:
+                break
+    return prompts
+
+
+def _generar(modelo, tokenizer, prompts):
+    """Salida greedy y logits del primer token de cada prompt."""
+    salidas, logits = [], []
+    with torch.no_grad():
+        for prompt in prompts:
+            inputs = tokenizer(prompt, return_tensors="pt").to(modelo.device)
+            resultado = modelo.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS, do_sample=False,
+                                        pad_token_id=tokenizer.eos_token_id,
+                                        output_scores=True, return_dict_in_generate=True)
+            salidas.append(tokenizer.decode(resultado.sequences[0, inputs['input_ids'].shape[1]:],
+                                            skip_special_tokens=True))
+            logits.append(resultado.scores[0][0].float().cpu())
+    return salidas, logits
+
+
+def verificar(ruta_base, adapter_path=ADAPTER_PATH, output_path=OUTPUT_PATH,
+              dataset_file=VERIFY_DATASET_FILE, num_ejemplos=VERIFY_EJEMPLOS, int8=False):
+    """
+    Compara el modelo fusionado (y la variante int8) con base + adaptador sin fusionar.
+    Los modelos se cargan de uno en uno para no duplicar el pico de memoria.
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.bfloat16 if device == "cuda" else torch.float32
+    tokenizer = AutoTokenizer.from_pretrained(output_path)
+    prompts = _prompts_de_verificacion(dataset_file, num_ejemplos)
+
+    base = AutoModelForCausalLM.from_pretrained(ruta_base, torch_dtype=dtype, device_map=device)
+    sin_fusionar = PeftModel.from_pretrained(base, adapter_path).eval()
+    esperadas, logits_esperados = _generar(sin_fusionar, tokenizer, prompts)
+    del base, sin_fusionar
+
+    modelos = [("fusionado", lambda: AutoModelForCausalLM.from_pretrained(output_path, torch_dtype=dtype, device_map=device))]
+    if int8:
+        modelos.append(("int8", lambda: torch.load(os.path.join(output_path, MODELO_INT8_FILE), weights_only=False)))
+
+    correcto = True
+    for nombre, cargar in modelos:
+        modelo = cargar().eval()
+        salidas, logits = _generar(modelo, tokenizer, prompts)
+        del modelo
+        iguales = sum(a == b for a, b in zip(salidas, esperadas))
+        diferencia = max((a - b).abs().max().item() for a, b in zip(logits, logits_esperados))
+        rtol, atol = TOLERANCIA_LOGITS[dtype]
+        cercanos = [torch.allclose(a, b, rtol=rtol, atol=atol) for a, b in zip(logits, logits_esperados)]
+        print(f"Verificación {nombre}: {sum(cercanos)}/{len(prompts)} logits dentro de la tolerancia "
+              f"(rtol={rtol:g}, atol={atol:g}), {iguales}/{len(prompts)} salidas idénticas, "
+              f"máx. |Δ logits| del primer token = {diferencia:.4g}")
+        # El fusionado debe coincidir hasta el redondeo del dtype; int8 es aproximado y sólo se informa
+        if nombre == "fusionado" and not all(cercanos):
+            correcto = False
+            for prompt, salida, esperada, cercano in zip(prompts, salidas, esperadas, cercanos):
+                if not cercano:
+                    print(f"  {prompt!r}: {salida!r} (esperada {esperada!r})")
+    return correcto
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fusiona un adaptador LoRA con su modelo base, shard a shard.")
+    parser.add_argument("--adaptador", default=ADAPTER_PATH)
+    parser.add_argument("--base", default=None, help="Modelo base (por defecto, el de adapter_config.json).")
+    parser.add_argument("--salida", default=OUTPUT_PATH)
+    parser.add_argument("--int8", action="store_true", help=f"Genera también {MODELO_INT8_FILE} para CPU.")
+    parser.add_argument("--verificar", type=int, default=0, metavar="N",
+                        help="Compara con el modelo sin fusionar en N prompts del dataset.")
+    parser.add_argument("--dataset", default=VERIFY_DATASET_FILE, help="JSONL para la verificación.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    base = args.base
+    if base is None:
+        with open(os.path.join(args.adaptador, "adapter_config.json"), encoding='utf-8') as f:
+            base = json.load(f)["base_model_name_or_path"]
+
+    ruta_base = fusionar(base, args.adaptador, args.salida)
+    if args.int8:
+        exportar_int8(args.salida)
+    if args.verificar and not verificar(ruta_base, args.adaptador, args.salida, args.dataset, args.verificar, args.int8):
+        raise SystemExit("La verificación ha fallado: el modelo fusionado no reproduce al adaptador.")
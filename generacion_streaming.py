@@ -0,0 +1,106 @@
+import os
+import json
+import random
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+# Generación de datasets grandes en streaming (decenas de millones de filas sin tenerlas en memoria).
+# El trabajo se reparte en shards de tamaño fijo con una semilla derivada de (semilla, shard), así que la
+# salida depende sólo de la semilla y no del número de procesos. El barajado es externo en dos pasadas:
+#   1. Cada shard genera sus filas y reparte cada una, al azar, en uno de N cubos (un fichero por shard y cubo).
+#   2. Cada cubo se lee (sus trozos en orden de shard), se baraja en memoria con su propia semilla y se escribe.
+# Los cubos se concatenan en orden: el resultado es una permutación uniforme y la memoria máxima es un cubo.
+ITERACIONES_POR_SHARD = 50_000
+FILAS_POR_CUBO = 500_000     # Máximo aproximado de filas en memoria durante el barajado
+
+
+def rng_shard(semilla: int, etapa: str, indice: int) -> random.Random:
+    """Generador aleatorio propio de un shard o cubo (semillas en texto: deterministas entre procesos)."""
+    return random.Random(f"{semilla}-{etapa}-{indice}")
+
+
+def _ruta_trozo(directorio, shard, cubo):
+    return os.path.join(directorio, f"shard{shard:05d}-cubo{cubo:05d}.jsonl")
+
+
+def _generar_shard(args):
+    """Pasada 1: genera las iteraciones [inicio, fin) del shard y reparte sus filas entre los cubos."""
+    funcion_iteracion, indice, inicio, fin, semilla, num_cubos, directorio = args
+    rng = rng_shard(semilla, "shard", indice)
+    ficheros = [open(_ruta_trozo(directorio, indice, cubo), 'w', encoding='utf-8') for cubo in range(num_cubos)]
+    filas = 0
+    try:
+        for _ in range(inicio, fin):
+            for fila in funcion_iteracion(rng):
+                ficheros[rng.randrange(num_cubos)].write(json.dumps(fila, ensure_ascii=False) + '\n')
+                filas += 1
+    finally:
+        for f in ficheros:
+            f.close()
+    return filas
+
+
+def _barajar_cubo(args):
+    """Pasada 2: junta los trozos de un cubo en orden de shard, los baraja y los escribe en un fichero."""
+    indice, num_shards, semilla, directorio = args
+    lineas = []
+    for shard in range(num_shards):
+        ruta = _ruta_trozo(directorio, shard, indice)
+        with open(ruta, encoding='utf-8') as f:
+            lineas.extend(f)
+        os.remove(ruta)
+    rng_shard(semilla, "cubo", indice).shuffle(lineas)
+    destino = os.path.join(directorio, f"cubo{indice:05d}.jsonl")
+    with open(destino, 'w', encoding='utf-8') as f:
+        f.writelines(lineas)
+    return destino, len(lineas)
+
+
+def generar_streaming(funcion_iteracion, num_iteraciones, output_file, semilla=0, num_workers=1, max_filas=None):
+    """
+    Ejecuta 'funcion_iteracion(rng)' num_iteraciones veces (cada llamada devuelve una lista de filas),
+    baraja todas las filas y escribe como mucho 'max_filas' en output_file (JSONL).
+    'funcion_iteracion' debe ser una función de nivel de módulo (se envía a los procesos worker) y usar
+    sólo el rng que recibe. Para una misma semilla el fichero es idéntico byte a byte con cualquier num_workers.
+    """
+    num_shards = max(1, -(-num_iteraciones // ITERACIONES_POR_SHARD))
+    # Filas estimadas a partir de una muestra (sólo decide el número de cubos, que es función de la semilla)
+    filas_muestra = sum(len(funcion_iteracion(rng_shard(semilla, "muestra", i))) for i in range(100))
+    num_cubos = max(1, -(-num_iteraciones * filas_muestra // (100 * FILAS_POR_CUBO)))
+
+    directorio = tempfile.mkdtemp(prefix="generacion-", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        tareas_shard = [(funcion_iteracion, i, i * ITERACIONES_POR_SHARD,
+                         min(num_iteraciones, (i + 1) * ITERACIONES_POR_SHARD), semilla, num_cubos, directorio)
+                        for i in range(num_shards)]
+        tareas_cubo = [(i, num_shards, semilla, directorio) for i in range(num_cubos)]
+        if num_workers > 1:
+            with Pool(num_workers) as pool:
+                total = sum(pool.imap_unordered(_generar_shard, tareas_shard))
+                cubos = pool.map(_barajar_cubo, tareas_cubo)
+        else:
+            total = sum(map(_generar_shard, tareas_shard))
+            cubos = list(map(_barajar_cubo, tareas_cubo))
+        print(f"{total} filas generadas en {num_shards} shards y barajadas en {num_cubos} cubos.")
+
+        # Concatenación en orden de cubo, truncando a max_filas; se escribe aparte y se renombra al final
+        restantes = total if max_filas is None else min(max_filas, total)
+        escritas = restantes
+        temporal = f"{output_file}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as salida:
+            for ruta, num_lineas in cubos:
+                if restantes == 0:
+                    break
+                with open(ruta, encoding='utf-8') as f:
+                    if num_lineas <= restantes:
+                        shutil.copyfileobj(f, salida)
+                        restantes -= num_lineas
+                    else:
+                        for _, linea in zip(range(restantes), f):
+                            salida.write(linea)
+                        restantes = 0
+        os.replace(temporal, output_file)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    return escritas
@@ -0,0 +1,193 @@
+# --- Parte 1: Importaciones y Configuración ---
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from collections import deque
+
+import local_api_server as core # Misma carga de modelo, reglas, caché y micro-batching que la API
+
+# Resolución offline de ficheros JSONL grandes (p. ej. históricos de reservas) sin pasar por HTTP.
+# Cada línea de entrada {"peticion", "contexto_base", ...} se escribe en la salida, en el mismo orden,
+# con su "salida_absoluta" (o "error"). El progreso se guarda en <salida>.progreso.json: si el proceso
+# muere, al relanzarlo continúa desde la última línea confirmada.
+ENTRADA = "requests.jsonl"
+SALIDA = "resultados.jsonl"
+NUM_WORKERS = 1              # Procesos que comparten los pesos (fork, sólo Unix)
+TAMANO_BLOQUE = 256          # Líneas por tarea; dentro de cada worker se agrupan en lotes de BATCH_MAX_SIZE
+BLOQUES_EN_VUELO = 2         # Bloques pendientes por worker (acota la memoria con ficheros enormes)
+INTERVALO_INFORME_S = 10.0   # Cada cuánto se imprime el rendimiento
+INTERVALO_PROGRESO_S = 5.0   # Cada cuánto se confirma el progreso en disco
+
+# --- Parte 2: Resolución de bloques (se ejecuta en los workers) ---
+
+def _iniciar_worker(hilos):
+    """Inicializador de cada worker: su presupuesto de hilos, el prefijo y el calentamiento."""
+    core.configurar_hilos_worker(hilos)
+    if core.PREFIX_KV_CACHE:
+        core.prepare_prefix_cache()
+    core.warm_up()
+
+def resolver_bloque(lineas):
+    """Resuelve un bloque de líneas JSONL y devuelve el texto de salida (una línea por línea no vacía)."""
+    lineas = [linea for linea in lineas if linea.strip()]
+    filas = []
+    for linea in lineas:
+        try:
+            fila = json.loads(linea)
+        except ValueError:
+            fila = None
+        filas.append(fila if isinstance(fila, dict) else None)
+
+    # Las líneas no válidas van como elemento vacío: predict_times devuelve su error sin cortar el bloque
+    resultados = core.predict_times([fila if fila is not None else {} for fila in filas])
+    salidas = []
+    for linea, fila, resultado in zip(lineas, filas, resultados):
+        if fila is None:
+            salida = {"error": "La línea no es un objeto JSON válido.", "linea": linea.rstrip("\n")}
+        elif "error" in resultado:
+            salida = {**fila, "error": resultado["error"]}
+        else:
+            salida = {**fila, "salida_absoluta": resultado["salida_absoluta"]}
+        salidas.append(json.dumps(salida, ensure_ascii=False) + '\n')
+    return "".join(salidas)
+
+# --- Parte 3: Lectura en streaming, orden de salida y progreso ---
+
+def _leer_bloques(f, tamano_bloque):
+    """Bloques (líneas, offset de la entrada tras el bloque) leídos en streaming desde la posición actual."""
+    while True:
+        lineas = []
+        for _ in range(tamano_bloque):
+            linea = f.readline()
+            if not linea:
+                break
+            lineas.append(linea.decode("utf-8", errors="replace"))
+        if not lineas:
+            return
+        yield lineas, f.tell()
+
+def _ruta_progreso(salida):
+    return f"{salida}.progreso.json"
+
+def leer_progreso(entrada, salida):
+    """Progreso confirmado de una ejecución anterior sobre la misma entrada, o None."""
+    ruta = _ruta_progreso(salida)
+    if not os.path.exists(ruta) or not os.path.exists(salida):
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        progreso = json.load(f)
+    if progreso["entrada"] != os.path.abspath(entrada) or progreso["tamano_entrada"] != os.path.getsize(entrada):
+        raise SystemExit(f"{ruta} corresponde a otra entrada; usa --desde-cero para empezar de nuevo.")
+    return progreso
+
+def guardar_progreso(entrada, salida, offset_entrada, bytes_salida, lineas):
+    """Confirma el progreso de forma atómica (la salida ya está volcada a disco hasta bytes_salida)."""
+    ruta = _ruta_progreso(salida)
+    with open(f"{ruta}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({"entrada": os.path.abspath(entrada), "tamano_entrada": os.path.getsize(entrada),
+                   "offset_entrada": offset_entrada, "bytes_salida": bytes_salida, "lineas": lineas}, f)
+    os.replace(f"{ruta}.tmp", ruta)
+
+def ejecutar(entrada=ENTRADA, salida=SALIDA, num_workers=NUM_WORKERS, tamano_bloque=TAMANO_BLOQUE,
+             reanudar=True, hilos_worker=1):
+    """
+    Resuelve todo el fichero de entrada con el modelo ya cargado en core (con num_workers > 1, cargado
+    con prefill_prefix=False). Devuelve el número de líneas procesadas en esta ejecución.
+    """
+    progreso = leer_progreso(entrada, salida) if reanudar else None
+    offset_entrada, bytes_salida, lineas_previas = 0, 0, 0
+    if progreso is not None:
+        offset_entrada, bytes_salida, lineas_previas = progreso["offset_entrada"], progreso["bytes_salida"], progreso["lineas"]
+        print(f"Reanudando desde la línea {lineas_previas} ({offset_entrada} bytes de {entrada}).")
+
+    # Los workers heredan por fork el modelo ya cargado (como el modo pre-fork del servidor)
+    pool = None
+    if num_workers > 1:
+        pool = multiprocessing.get_context("fork").Pool(
+            num_workers, initializer=_iniciar_worker, initargs=(hilos_worker,))
+
+    tamano_entrada = os.path.getsize(entrada)
+    inicio = ultimo_informe = ultimo_progreso = time.perf_counter()
+    lineas_informe = lineas = 0
+    en_vuelo = deque()
+
+    # La salida se trunca al último punto confirmado: lo escrito después se vuelve a generar
+    with open(entrada, 'rb') as f, open(salida, 'r+b' if progreso is not None else 'wb') as out:
+        out.truncate(bytes_salida)
+        out.seek(bytes_salida)
+        f.seek(offset_entrada)
+
+        def escribir_siguiente():
+            nonlocal lineas, ultimo_progreso, ultimo_informe, lineas_informe
+            resultado, offset, num_lineas = en_vuelo.popleft()
+            out.write((resultado.get() if pool is not None else resultado).encode("utf-8"))
+            lineas += num_lineas
+
+            ahora = time.perf_counter()
+            if ahora - ultimo_progreso >= INTERVALO_PROGRESO_S or not en_vuelo:
+                out.flush()
+                os.fsync(out.fileno())
+                guardar_progreso(entrada, salida, offset, out.tell(), lineas_previas + lineas)
+                ultimo_progreso = ahora
+            if ahora - ultimo_informe >= INTERVALO_INFORME_S:
+                ritmo = (lineas - lineas_informe) / (ahora - ultimo_informe)
+                media = lineas / (ahora - inicio)
+                # ETA por bytes leídos: no hace falta contar antes las líneas del fichero
+                bytes_por_segundo = (offset - offset_entrada) / (ahora - inicio)
+                eta_min = (tamano_entrada - offset) / bytes_por_segundo / 60 if bytes_por_segundo else 0.0
+                print(f"{lineas_previas + lineas} líneas ({offset / tamano_entrada:.1%}) | {ritmo:.1f} líneas/s "
+                      f"(media {media:.1f}) | ETA {eta_min:.1f} min")
+                ultimo_informe, lineas_informe = ahora, lineas
+
+        try:
+            for bloque, offset in _leer_bloques(f, tamano_bloque):
+                if pool is not None:
+                    en_vuelo.append((pool.apply_async(resolver_bloque, (bloque,)), offset, len(bloque)))
+                else:
+                    en_vuelo.append((resolver_bloque(bloque), offset, len(bloque)))
+                # Se escribe en el orden de entrada, esperando al bloque más antiguo
+                while len(en_vuelo) >= BLOQUES_EN_VUELO * max(1, num_workers):
+                    escribir_siguiente()
+            while en_vuelo:
+                escribir_siguiente()
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    duracion = time.perf_counter() - inicio
+    if os.path.exists(_ruta_progreso(salida)):
+        os.remove(_ruta_progreso(salida))
+    print(f"Completado: {lineas} líneas en {duracion:.1f}s ({lineas / duracion:.1f} líneas/s) -> {salida}")
+    return lineas
+
+# --- Parte 4: Línea de comandos ---
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resolución TLP por lotes: JSONL de entrada -> JSONL de salida.")
+    parser.add_argument("entrada", nargs="?", default=ENTRADA)
+    parser.add_argument("salida", nargs="?", default=SALIDA)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Procesos worker (comparten los pesos).")
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE, help="Líneas por tarea.")
+    parser.add_argument("--desde-cero", action="store_true", help="Ignora el progreso guardado.")
+    parser.add_argument("--cpu-backend", choices=["float32", "int8", *core.MODELOS_ONNX],
+                        default=core.CPU_BACKEND)
+    parser.add_argument("--threads", type=int, default=core.CPU_NUM_THREADS, help="Hilos de inferencia por worker.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    core.CPU_BACKEND = args.cpu_backend
+    core.CPU_NUM_THREADS = args.threads
+    hilos_worker = args.threads
+    if args.workers > 1:
+        # Reparto de núcleos entre workers; el padre sólo carga pesos con un hilo (sin pools de OpenMP antes del fork)
+        hilos_worker = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+        core.CPU_NUM_THREADS = 1
+        core.load_model(prefill_prefix=False)
+    else:
+        core.load_model()
+        core.warm_up()
+    ejecutar(args.entrada, args.salida, args.workers, args.bloque, reanudar=not args.desde_cero,
+             hilos_worker=hilos_worker)
@@ -1,11 +1,29 @@
 # --- Parte 1: Importaciones y Configuración ---
 import torch
+import numpy as np
 import re
-import pandas as pd
-from flask import Flask, request, jsonify
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-from datasets import load_dataset # Necesario para cargar las clases de datasets
-from peft import PeftModel # Necesario para la clase PeftModel
+import copy
+import os
+import glob
+import json
+import hmac
+import mmap
+import time
+import signal
+import socket
+import struct
+import argparse
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from flask import Flask, Response, request, jsonify
+from werkzeug.serving import make_server
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, LogitsProcessorList, MinNewTokensLengthLogitsProcessor
+from reglas_tlp import resolver_peticion
+import cache_tlp
+import metricas
+from plantillas import PREFIJO_TLP, formatear_prompt
+from decodificacion import ProcesadorFormato, MarcaPrimerToken, PLANTILLA_FECHA_HORA, max_new_tokens_para
 
 # Configuración del servidor
 app = Flask(__name__)
@@ -15,74 +33,709 @@ PORT = 5000
 MODEL_ID = "Qwen/Qwen1.5-1.8B-Chat"
 FUSED_MODEL_PATH = "qwen_hora_fusionado" # Tu modelo final fusionado (TLP)
 
+# Multi-adaptador: con BASE_MODEL_PATH se carga el modelo base una sola vez (en lugar de FUSED_MODEL_PATH)
+# y los adaptadores LoRA quedan residentes; cada petición elige el suyo con el campo 'adaptador'.
+BASE_MODEL_PATH = None       # p. ej. MODEL_ID
+ADAPTERS = {}                # Adaptadores que se cargan al arrancar: nombre -> ruta del adaptador PEFT
+DEFAULT_ADAPTER = None       # Adaptador de las peticiones sin 'adaptador' (None = modelo base sin adaptar)
+ADMIN_TOKEN = os.environ.get("TLP_ADMIN_TOKEN") # /admin/* exige la cabecera X-Admin-Token; sin token, desactivado
+
+# Micro-batching: ventana de agrupación de peticiones concurrentes
+BATCH_MAX_SIZE = 8      # Máximo de prompts por llamada a model.generate
+BATCH_MAX_WAIT_MS = 10  # Tiempo máximo que espera el primer prompt a que lleguen más
+BATCH_ENDPOINT_MAX_ITEMS = 1000  # Máximo de elementos aceptados por /predict_time/batch
+
+# Vía rápida: reglas deterministas (reglas_tlp.py) antes de llamar al modelo
+RULES_FAST_PATH = True
+
+# Caché LRU de resultados del modelo como reglas relativas al contexto (cache_tlp.py)
+RESULT_CACHE = True
+
+# Decodificación restringida a la plantilla YYYY-MM-DD HH:MM (decodificacion.py)
+CONSTRAINED_DECODING = True
+
+# Prefijo fijo del prompt TLP: sus past-key-values se calculan una vez y se reutilizan.
+# Sólo sirve el prefijo inicial; las etiquetas "Peticion_Usuario:"/"Salida_ABSOLUTA:" van
+# detrás de texto variable, así que su KV depende de cada petición.
+PROMPT_PREFIX = PREFIJO_TLP
+PREFIX_KV_CACHE = True
+
+# Backend de CPU (los nodos edge sirven el modelo fusionado sin GPU)
+CPU_BACKEND = "float32"      # "float32", "int8" (cuantización dinámica de las capas Linear), "onnx" u "onnx_int8"
+MODELO_INT8_FILE = "modelo_int8.pt" # Variante ya cuantizada que genera fusionar_adaptador.py --int8
+# Modelos ONNX (con el KV cache como entradas/salidas) que genera exportar_onnx.py, por backend de ONNX Runtime
+MODELOS_ONNX = {"onnx": "modelo.onnx", "onnx_int8": "modelo_int8.onnx"}
+CPU_NUM_THREADS = None       # Hilos intra-op de torch (None = valor por defecto de torch)
+CPU_INTEROP_THREADS = None   # Hilos inter-op de torch (None = valor por defecto de torch)
+TORCH_COMPILE = False        # Compila el forward del modelo con torch.compile
+SELF_CHECK = True            # Mide tokens/s al arrancar para comparar configuraciones
+
+# Modo pre-fork: el proceso padre carga los pesos una vez y N workers los comparten (copy-on-write)
+PREFORK_WORKERS = 1          # 1 = un solo proceso (app.run)
+MMAP_WEIGHTS = True          # Pesos respaldados por el mmap de los .safetensors (page cache compartida)
+
+# Tipos de safetensors que se pueden mapear directamente a tensores de torch
+SAFETENSORS_DTYPES = {"F32": torch.float32, "BF16": torch.bfloat16, "F16": torch.float16}
+
 # Variables globales para el modelo
-model = None
+model = None        # Modelo de transformers o, con los backends ONNX, la sesión de ONNX Runtime
 tokenizer = None
 device = None
+backend_onnx = False
+prefix_ids = None    # Tokens del prefijo compartido
+prefix_caches = {}   # Past-key-values del prefijo (batch 1) por adaptador (None = modelo sin adaptador)
+adaptadores = {}     # Adaptadores residentes: nombre -> ruta
+nombres_peft = {}    # Nombre del adaptador dentro de PEFT (cambia al recargarlo en caliente): nombre -> nombre PEFT
+adaptadores_lock = threading.Lock() # Evita cargar/descargar un adaptador mientras el worker genera con él
+
+# Readiness: /healthz responde siempre, /readyz sólo con el modelo cargado y calentado
+model_ready = threading.Event()
+load_error = None
+
+# Petición de calentamiento: no encaja en las reglas, así que recorre el camino completo del modelo
+WARMUP_PETICION = "Quiero un taxi cuando termine la reunión."
+WARMUP_CONTEXTO = "2025-01-01 10:00"
+
+# Cola de prompts pendientes y worker que los agrupa
+batch_queue = queue.Queue()
+batch_worker = None
+
+# Métricas expuestas en /metrics (metricas.py)
+metricas.describir("tlp_peticiones_total", "counter", "Peticiones resueltas por ruta (reglas, cache, modelo).")
+metricas.describir("tlp_peticion_segundos", "histogram", "Latencia total de predict_time por ruta.")
+metricas.describir("tlp_etapa_segundos", "histogram", "Tiempo por etapa: cola, tokenizacion, prefill, decodificacion, detokenizacion, extraccion.")
+metricas.describir("tlp_batch_size", "histogram", "Prompts por llamada a model.generate.")
+metricas.describir("tlp_tokens_generados_total", "counter", "Tokens generados por el modelo.")
+metricas.describir("tlp_error_parsing_total", "counter", "Salidas del modelo sin formato YYYY-MM-DD HH:MM.")
+metricas.describir("tlp_info", "gauge", "Configuración de inferencia (dispositivo y backend).")
+metricas.describir("tlp_cola_pendientes", "gauge", "Prompts esperando al worker de micro-batching.")
 
 # --- Parte 2: Lógica de Carga y Predicción del Modelo ---
 
-def load_model():
-    """Carga el modelo fusionado en el dispositivo disponible (CPU o CUDA)."""
-    global model, tokenizer, device
+def configure_cpu_threads():
+    """Aplica el reparto de hilos intra-op/inter-op de torch configurado."""
+    if CPU_NUM_THREADS:
+        torch.set_num_threads(CPU_NUM_THREADS)
+    if CPU_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(CPU_INTEROP_THREADS)
+        except RuntimeError:
+            # Sólo se puede fijar antes del primer trabajo paralelo de torch
+            print("Aviso: no se pudo cambiar el número de hilos inter-op (torch ya los inicializó).")
+
+def _mmap_state_dict(model_path, dtype):
+    """
+    Mapea en memoria los .safetensors del modelo y devuelve sus tensores sin copiarlos.
+    Sólo incluye los tensores cuyo tipo coincide con 'dtype' (los demás necesitan conversión).
+    """
+    state_dict = {}
+    for fichero in sorted(glob.glob(os.path.join(model_path, "*.safetensors"))):
+        with open(fichero, "rb") as f:
+            longitud_cabecera = struct.unpack("<Q", f.read(8))[0]
+            cabecera = json.loads(f.read(longitud_cabecera))
+            # MAP_PRIVATE: las páginas se comparten con la page cache hasta que alguien escribe
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        inicio_datos = 8 + longitud_cabecera
+        for nombre, info in cabecera.items():
+            if nombre == "__metadata__" or SAFETENSORS_DTYPES.get(info["dtype"]) != dtype:
+                continue
+            inicio, fin = info["data_offsets"]
+            tensor = torch.frombuffer(mapa, dtype=dtype, count=(fin - inicio) // dtype.itemsize,
+                                      offset=inicio_datos + inicio)
+            state_dict[nombre] = tensor.view(info["shape"])
+    return state_dict
+
+def share_weights_mmap():
+    """Sustituye los pesos cargados por tensores respaldados por el mmap de los .safetensors."""
+    state_dict = _mmap_state_dict(FUSED_MODEL_PATH, model.dtype)
+    if not state_dict:
+        print(f"Aviso: los .safetensors no están en {model.dtype}; los pesos se comparten sólo por copy-on-write.")
+        return
+
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    print(f"Pesos mapeados en memoria: {len(state_dict)} tensores.")
+
+def crear_sesion_onnx(hilos=None):
+    """Sesión de ONNX Runtime (CPU) del modelo ONNX del backend actual."""
+    import onnxruntime as ort # Dependencia opcional: sólo la necesitan los backends ONNX
+    ruta = os.path.join(FUSED_MODEL_PATH, MODELOS_ONNX[CPU_BACKEND])
+    if not os.path.exists(ruta):
+        opcion = " --int8" if CPU_BACKEND == "onnx_int8" else ""
+        raise FileNotFoundError(f"No existe {ruta}: genéralo con 'python exportar_onnx.py{opcion}'.")
+    opciones = ort.SessionOptions()
+    opciones.intra_op_num_threads = hilos or CPU_NUM_THREADS or 0 # 0 = valor por defecto de ONNX Runtime
+    opciones.inter_op_num_threads = CPU_INTEROP_THREADS or 0
+    return ort.InferenceSession(ruta, opciones, providers=["CPUExecutionProvider"])
+
+def configurar_hilos_worker(hilos):
+    """Presupuesto de hilos de un worker tras el fork (los hilos de ONNX Runtime no sobreviven al fork)."""
+    global model
+    torch.set_num_threads(hilos)
+    if backend_onnx:
+        model = crear_sesion_onnx(hilos)
+
+def load_model(prefill_prefix: bool = True):
+    """Carga el modelo fusionado (o el base con sus adaptadores) en el dispositivo disponible (CPU o CUDA)."""
+    global model, tokenizer, device, backend_onnx
     
     device = "cuda" if torch.cuda.is_available() else "cpu"
+    backend_onnx = False
     print(f"Cargando modelo TLP en: {device}")
+    if device == "cpu":
+        configure_cpu_threads()
     
-    # El modelo fusionado se carga directamente, sin PEFT ni BNB (asumiendo que está fusionado)
-    model = AutoModelForCausalLM.from_pretrained(
-        FUSED_MODEL_PATH,
-        torch_dtype=torch.bfloat16 if device == "cuda" else torch.float32,
-        device_map=device
-    )
-    model.eval()
+    ruta_modelo = BASE_MODEL_PATH or FUSED_MODEL_PATH
+    ruta_int8 = os.path.join(FUSED_MODEL_PATH, MODELO_INT8_FILE)
+    if BASE_MODEL_PATH:
+        # Modelo base compartido por todos los adaptadores (las capas LoRA necesitan pesos en coma flotante)
+        if CPU_BACKEND != "float32":
+            print(f"Aviso: con adaptadores el backend de CPU es float32 (se ignora '{CPU_BACKEND}').")
+        model = AutoModelForCausalLM.from_pretrained(
+            BASE_MODEL_PATH,
+            torch_dtype=torch.bfloat16 if device == "cuda" else torch.float32,
+            device_map=device
+        )
+        model.eval()
+    elif device == "cpu" and CPU_BACKEND == "int8" and os.path.exists(ruta_int8):
+        # Variante int8 ya cuantizada al exportar: no hace falta pasar por float32
+        model = torch.load(ruta_int8, weights_only=False)
+        model.eval()
+        print(f"Modelo int8 cargado desde {ruta_int8}")
+    elif device == "cpu" and CPU_BACKEND in MODELOS_ONNX:
+        # Grafo exportado por exportar_onnx.py: la decodificación greedy la hace _generar_onnx
+        model = crear_sesion_onnx()
+        backend_onnx = True
+        print(f"Modelo ONNX cargado desde {os.path.join(FUSED_MODEL_PATH, MODELOS_ONNX[CPU_BACKEND])}")
+    else:
+        # El modelo fusionado se carga directamente, sin PEFT ni BNB (asumiendo que está fusionado)
+        model = AutoModelForCausalLM.from_pretrained(
+            FUSED_MODEL_PATH,
+            torch_dtype=torch.bfloat16 if device == "cuda" else torch.float32,
+            device_map=device
+        )
+        model.eval()
+
+        # Pesos compartidos vía mmap (sólo si no se van a transformar después)
+        if device == "cpu" and CPU_BACKEND == "float32" and MMAP_WEIGHTS:
+            share_weights_mmap()
+
+        # Backend de CPU: cuantización dinámica int8 de las capas Linear
+        if device == "cpu" and CPU_BACKEND == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    # Los adaptadores iniciales se cargan antes de compilar para que el grafo ya incluya las capas LoRA
+    for nombre, ruta in ADAPTERS.items():
+        cargar_adaptador(nombre, ruta)
+
+    if TORCH_COMPILE and not backend_onnx:
+        model.forward = torch.compile(model.forward, dynamic=True)
     
-    tokenizer = AutoTokenizer.from_pretrained(FUSED_MODEL_PATH)
+    tokenizer = AutoTokenizer.from_pretrained(ruta_modelo)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
     tokenizer.padding_side = "left"
+
+    metricas.fijar("tlp_info", 1, device=device, backend=CPU_BACKEND if device == "cpu" else str(model.dtype))
+
+    # En modo pre-fork el padre no ejecuta el modelo: cada worker calcula su propio prefijo
+    if PREFIX_KV_CACHE and prefill_prefix:
+        prepare_prefix_cache()
     
     print("Modelo Qwen TLP cargado exitosamente.")
 
-def predict_time(peticion: str, contexto_base: str):
-    """Genera la hora absoluta a partir de la petición y el contexto base."""
-    if model is None or tokenizer is None:
-        return "Error: Modelo no cargado", 500
+def prepare_prefix_cache():
+    """Precalcula los past-key-values del prefijo común, para el modelo sin adaptar y cada adaptador."""
+    global prefix_ids
 
-    # 1. Crear el prompt en el formato TLP del entrenamiento
-    prompt = (
-        f"Contexto_AHORA: {contexto_base}\n"
-        f"Peticion_Usuario: {peticion}\n"
-        f"Salida_ABSOLUTA:"
-    )
+    # Sólo se reutilizan los tokens en los que coinciden el prefijo solo y un prompt completo
+    # (el BPE puede fusionar el último token del prefijo con lo que venga detrás)
+    solo = tokenizer(PROMPT_PREFIX)['input_ids']
+    completo = tokenizer(build_prompt("x", "2025-01-01 00:00"))['input_ids']
+    n = 0
+    while n < min(len(solo), len(completo)) and solo[n] == completo[n]:
+        n += 1
+    if n == 0:
+        return
 
-    # 2. Tokenización
-    inputs = tokenizer(prompt, return_tensors="pt", padding=True).to(device)
+    prefix_ids = completo[:n]
+    prefix_caches.clear()
+    for adaptador in [None, *adaptadores]:
+        _calcular_prefijo(adaptador)
 
-    # 3. Generación
+def _calcular_prefijo(adaptador):
+    """KV del prefijo con un adaptador concreto (LoRA cambia las proyecciones k/v)."""
+    if backend_onnx:
+        # Con ONNX Runtime el KV es la lista de arrays presente.* (batch 1) del prefill del prefijo
+        _, *prefix_caches[adaptador] = model.run(None, _entradas_onnx(
+            np.array([prefix_ids]), np.ones((1, len(prefix_ids)), dtype=np.int64), _pasado_vacio_onnx(1)))
+        return
+    cache = DynamicCache()
     with torch.no_grad():
-        output_tokens = model.generate(
+        model(input_ids=torch.tensor([prefix_ids], device=device), past_key_values=cache, use_cache=True,
+              **_kwargs_adaptador(adaptador, 1))
+    prefix_caches[adaptador] = cache
+
+def _kwargs_adaptador(adaptador, num_filas):
+    """Argumento de PEFT para usar un adaptador concreto en todas las filas del lote."""
+    if not hasattr(model, "peft_config"):
+        return {}
+    return {"adapter_names": [nombres_peft.get(adaptador, "__base__")] * num_filas}
+
+def cargar_adaptador(nombre: str, ruta: str):
+    """
+    Carga (o recarga) un adaptador LoRA sobre el modelo base residente (la primera vez envuelve el modelo en PeftModel).
+    Al recargar, los pesos nuevos entran con un nombre PEFT temporal mientras el anterior sigue sirviendo;
+    después se cambia el nombre bajo el lock y sólo entonces se borra el adaptador anterior.
+    """
+    global model
+    anterior = nombres_peft.get(nombre)
+    nombre_peft = nombre if anterior is None else f"{nombre}__{time.monotonic_ns()}"
+    with adaptadores_lock:
+        try:
+            if hasattr(model, "peft_config"):
+                model.load_adapter(ruta, adapter_name=nombre_peft)
+            else:
+                from peft import PeftModel # Sólo hace falta en modo --base (importar peft es lento)
+                model = PeftModel.from_pretrained(model, ruta, adapter_name=nombre_peft)
+        except Exception:
+            if hasattr(model, "peft_config") and nombre_peft in model.peft_config:
+                model.delete_adapter(nombre_peft) # Carga a medias: el adaptador anterior queda intacto
+            raise
+        model.eval()
+
+    with adaptadores_lock:
+        nombres_peft[nombre] = nombre_peft
+        adaptadores[nombre] = ruta
+        cache_tlp.invalidar(nombre)
+        if PREFIX_KV_CACHE and prefix_ids is not None:
+            _calcular_prefijo(nombre)
+
+    if anterior is not None:
+        with adaptadores_lock:
+            model.delete_adapter(anterior)
+    print(f"Adaptador '{nombre}' cargado desde {ruta}.")
+
+def descargar_adaptador(nombre: str):
+    """Libera un adaptador residente, su KV de prefijo y sus entradas de la caché de resultados."""
+    global model
+    with adaptadores_lock:
+        if len(adaptadores) == 1:
+            # PEFT no admite quedarse sin adaptadores: se vuelve al modelo base sin envoltorio
+            model = model.unload()
+        else:
+            model.delete_adapter(nombres_peft[nombre])
+        del adaptadores[nombre]
+        del nombres_peft[nombre]
+        prefix_caches.pop(nombre, None)
+        cache_tlp.invalidar(nombre)
+    print(f"Adaptador '{nombre}' descargado.")
+
+def _tokenize_with_prefix(prompts, cache):
+    """
+    Tokeniza los prompts como [prefijo][padding][sufijo] para reutilizar el KV del prefijo.
+    El padding intermedio queda enmascarado y las posiciones salen de la máscara de atención.
+    Devuelve None si algún prompt no empieza por los tokens del prefijo.
+    """
+    encodings = tokenizer(prompts)['input_ids']
+    if any(ids[:len(prefix_ids)] != prefix_ids for ids in encodings):
+        return None
+
+    sufijos = [ids[len(prefix_ids):] for ids in encodings]
+    max_len = max(len(sufijo) for sufijo in sufijos)
+    input_ids, attention_mask = [], []
+    for sufijo in sufijos:
+        relleno = max_len - len(sufijo)
+        input_ids.append(prefix_ids + [tokenizer.pad_token_id] * relleno + sufijo)
+        attention_mask.append([1] * len(prefix_ids) + [0] * relleno + [1] * len(sufijo))
+
+    if backend_onnx:
+        past_key_values = [np.repeat(tensor, len(prompts), axis=0) for tensor in cache]
+    else:
+        past_key_values = copy.deepcopy(cache)
+        past_key_values.batch_repeat_interleave(len(prompts))
+    return {
+        "input_ids": torch.tensor(input_ids, device=device),
+        "attention_mask": torch.tensor(attention_mask, device=device),
+        "past_key_values": past_key_values,
+    }
+
+def _pasado_vacio_onnx(batch):
+    """KV de longitud 0 para el grafo ONNX: el mismo grafo hace el prefill y cada paso de decodificación."""
+    return [np.zeros((batch, entrada.shape[1], 0, entrada.shape[3]), dtype=np.float32)
+            for entrada in model.get_inputs() if entrada.name.startswith("pasado.")]
+
+def _entradas_onnx(input_ids, attention_mask, pasado):
+    """
+    Entradas de un paso del grafo ONNX: los tokens nuevos, la máscara completa (pasado + nuevos) y
+    sus posiciones, calculadas desde la máscara como en model.generate (el padding no cuenta).
+    """
+    posiciones = attention_mask.cumsum(-1) - 1
+    posiciones[attention_mask == 0] = 1
+    nombres_pasado = [entrada.name for entrada in model.get_inputs() if entrada.name.startswith("pasado.")]
+    return {
+        "input_ids": np.ascontiguousarray(input_ids),
+        "attention_mask": attention_mask,
+        "position_ids": np.ascontiguousarray(posiciones[:, -input_ids.shape[1]:]),
+        **dict(zip(nombres_pasado, pasado)),
+    }
+
+def _generar_onnx(input_ids, attention_mask, past_key_values, max_new_tokens, logits_processor):
+    """
+    Decodificación greedy con ONNX Runtime equivalente a model.generate(do_sample=False): mismos logits
+    processors, las filas que ya emitieron EOS se rellenan con padding y se para cuando terminan todas.
+    Devuelve las secuencias completas (prompt + generados) como tensor de torch.
+    """
+    batch = input_ids.shape[0]
+    pasado = past_key_values if past_key_values is not None else _pasado_vacio_onnx(batch)
+    mascara = attention_mask.numpy()
+    nuevos = input_ids[:, pasado[0].shape[2]:].numpy() # Con el KV del prefijo sólo entra el sufijo
+    secuencias = input_ids
+    pendientes = torch.ones(batch, dtype=torch.bool)
+
+    for _ in range(max_new_tokens):
+        # Salidas en el orden de exportación: logits del último token y presente.* (alineado con pasado.*)
+        logits, *pasado = model.run(None, _entradas_onnx(nuevos, mascara, pasado))
+        scores = logits_processor(secuencias, torch.from_numpy(logits))
+        siguiente = torch.where(pendientes, scores.argmax(dim=-1), tokenizer.pad_token_id)
+        secuencias = torch.cat([secuencias, siguiente[:, None]], dim=1)
+        pendientes &= siguiente != tokenizer.eos_token_id
+        if not pendientes.any():
+            break
+        nuevos = siguiente[:, None].numpy()
+        mascara = np.concatenate([mascara, np.ones((batch, 1), dtype=mascara.dtype)], axis=1)
+    return secuencias
+
+def self_check(num_tokens=16, repeticiones=3):
+    """Mide tokens/s de decodificación greedy con batch 1 y con BATCH_MAX_SIZE para la configuración actual."""
+    prompt = build_prompt("Quiero reservar un taxi para mañana a las ocho y media de la tarde.", "2025-01-01 10:00")
+    informe = {
+        "device": device,
+        "backend": CPU_BACKEND if device == "cpu" else str(model.dtype),
+        "threads": model.get_session_options().intra_op_num_threads if backend_onnx else torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "torch_compile": TORCH_COMPILE,
+    }
+
+    for batch in (1, BATCH_MAX_SIZE):
+        inputs = tokenizer([prompt] * batch, return_tensors="pt", padding=True).to(device)
+        generar = lambda: model.generate(
             **inputs,
-            max_new_tokens=25, # Suficiente para YYYY-MM-DD HH:MM
+            max_new_tokens=num_tokens,
+            min_new_tokens=num_tokens, # Longitud fija para que la medida sea comparable
             do_sample=False,
-            eos_token_id=tokenizer.eos_token_id
+            pad_token_id=tokenizer.pad_token_id
         )
+        if backend_onnx:
+            minimo = LogitsProcessorList([MinNewTokensLengthLogitsProcessor(
+                inputs['input_ids'].shape[1], num_tokens, tokenizer.eos_token_id)])
+            generar = lambda: _generar_onnx(inputs['input_ids'], inputs['attention_mask'], None, num_tokens, minimo)
+        with torch.no_grad():
+            generar() # Calentamiento (y compilación, si está activada)
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                generar()
+            duracion = time.perf_counter() - inicio
 
-    # 4. Decodificación y post-procesamiento
-    generated_text = tokenizer.decode(output_tokens[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
-    
-    # 5. Extracción robusta del formato TLP (YYYY-MM-DD HH:MM)
+        informe[f"tokens_por_segundo_batch_{batch}"] = round(batch * num_tokens * repeticiones / duracion, 1)
+        informe[f"latencia_ms_batch_{batch}"] = round(duracion / repeticiones * 1000, 1)
+
+    print("Autodiagnóstico de inferencia:", informe)
+    return informe
+
+def build_prompt(peticion: str, contexto_base: str) -> str:
+    """Crea el prompt en el formato TLP del entrenamiento (plantillas.py)."""
+    return formatear_prompt("tlp", peticion=peticion, contexto_base=contexto_base)
+
+def extract_salida(generated_text: str) -> str:
+    """Extrae de forma robusta el formato TLP (YYYY-MM-DD HH:MM) del texto generado."""
     # Busca la salida de la reserva (ej: 2025-11-12 19:30)
     match = re.search(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}', generated_text)
-    
+
     if match:
         return match.group(0)
     else:
         # En caso de que el modelo falle, devolver la salida completa para debug
         return f"ERROR_PARSING: {generated_text.strip()}"
+
+def generate_batch(prompts, stats=None, adaptador=None):
+    """
+    Ejecuta una única llamada a model.generate (o al bucle greedy de ONNX Runtime) para una lista de
+    prompts (padding a la izquierda).
+    Todos los prompts usan el mismo 'adaptador' (None = modelo sin adaptar).
+    Si se pasa el dict 'stats', se rellena con los tokens generados por fila y el tiempo de cada etapa.
+    """
+    if stats is None:
+        stats = {}
+    t_inicio = time.perf_counter()
+
+    # 1. Tokenización conjunta: el padding a la izquierda alinea el final de todos los prompts.
+    #    Con el KV del prefijo precalculado, sólo se hace el prefill de los sufijos.
+    inputs = None
+    if PREFIX_KV_CACHE and prefix_caches.get(adaptador) is not None:
+        inputs = _tokenize_with_prefix(prompts, prefix_caches[adaptador])
+    if inputs is None:
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(device)
+
+    prompt_len = inputs['input_ids'].shape[1]
+    t_tokenizado = time.perf_counter()
+
+    # 2. Generación (con la plantilla, se para justo tras los 16 caracteres del timestamp).
+    #    MarcaPrimerToken separa el prefill (hasta los primeros logits) de la decodificación.
+    marca = MarcaPrimerToken()
+    logits_processor = LogitsProcessorList([marca])
+    max_new_tokens = 25 # Suficiente para YYYY-MM-DD HH:MM
+    if CONSTRAINED_DECODING:
+        logits_processor.append(ProcesadorFormato(tokenizer, PLANTILLA_FECHA_HORA, prompt_len))
+        max_new_tokens = max_new_tokens_para(PLANTILLA_FECHA_HORA)
+
+    if backend_onnx:
+        output_tokens = _generar_onnx(inputs['input_ids'], inputs['attention_mask'],
+                                      inputs.get('past_key_values'), max_new_tokens, logits_processor)
+    else:
+        with torch.no_grad():
+            output_tokens = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                logits_processor=logits_processor,
+                do_sample=False,
+                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=tokenizer.pad_token_id,
+                **_kwargs_adaptador(adaptador, len(prompts))
+            )
+
+    t_generado = time.perf_counter()
+
+    # 3. Decodificación: todas las filas comparten la longitud del prompt con padding
+    generados = output_tokens[:, prompt_len:]
+    textos = tokenizer.batch_decode(generados, skip_special_tokens=True)
+    t_fin = time.perf_counter()
+
+    primer_token = marca.primer_token or t_generado
+    stats["tokens_generados"] = (generados != tokenizer.pad_token_id).sum(dim=1).tolist()
+    stats["tokenizacion_s"] = t_tokenizado - t_inicio
+    stats["prefill_s"] = primer_token - t_tokenizado
+    stats["decodificacion_s"] = t_generado - primer_token
+    stats["detokenizacion_s"] = t_fin - t_generado
+    return textos
+
+def _batch_worker_loop():
+    """Agrupa los prompts que llegan dentro de la ventana y los resuelve con un solo generate."""
+    while True:
+        # Bloquea hasta que llegue el primer prompt del lote
+        pendientes = [batch_queue.get()]
+        limite = time.monotonic() + BATCH_MAX_WAIT_MS / 1000
+
+        # Completa el lote hasta BATCH_MAX_SIZE o hasta que se agote la ventana
+        while len(pendientes) < BATCH_MAX_SIZE:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                pendientes.append(batch_queue.get(timeout=restante))
+            except queue.Empty:
+                break
+
+        # Se descartan los prompts cuyo plazo ya venció (Future cancelado); los demás ya no se pueden cancelar
+        pendientes = [item for item in pendientes if item[1].set_running_or_notify_cancel()]
+
+        # Un generate por adaptador: el KV del prefijo y los pesos LoRA son distintos en cada uno
+        inicio_lote = time.perf_counter()
+        grupos = {}
+        for item in pendientes:
+            grupos.setdefault(item[3], []).append(item)
+        for adaptador, grupo in grupos.items():
+            _resolver_grupo(grupo, adaptador, inicio_lote)
+
+def _resolver_grupo(pendientes, adaptador, inicio_lote):
+    """Genera un lote de prompts del mismo adaptador y resuelve sus Futures."""
+    prompts = [prompt for prompt, _, _, _ in pendientes]
+    stats = {}
+    try:
+        with adaptadores_lock:
+            if adaptador is not None and adaptador not in adaptadores:
+                raise ValueError(f"Adaptador no cargado: {adaptador}")
+            textos = generate_batch(prompts, stats, adaptador)
+    except Exception as e:
+        for _, futuro, _, _ in pendientes:
+            futuro.set_exception(e)
+        return
+
+    # Métricas del lote: una observación por etapa y los tokens generados
+    metricas.observar("tlp_batch_size", len(prompts), buckets=metricas.BUCKETS_BATCH)
+    metricas.incrementar("tlp_tokens_generados_total", sum(stats["tokens_generados"]))
+    for etapa in ("tokenizacion", "prefill", "decodificacion", "detokenizacion"):
+        metricas.observar("tlp_etapa_segundos", stats[f"{etapa}_s"], etapa=etapa)
+
+    # Cada prompt recibe su texto y su desglose de tiempos (incluida su espera en cola)
+    for (_, futuro, encolado, _), texto, tokens in zip(pendientes, textos, stats["tokens_generados"]):
+        cola_s = inicio_lote - encolado
+        metricas.observar("tlp_etapa_segundos", cola_s, etapa="cola")
+        tiempos = {f"{etapa}_s": stats[f"{etapa}_s"] for etapa in ("tokenizacion", "prefill", "decodificacion", "detokenizacion")}
+        tiempos.update(cola_s=cola_s, tokens_generados=tokens, batch_size=len(prompts))
+        futuro.set_result((texto, tiempos))
+
+def start_batch_worker():
+    """Arranca (una sola vez) el hilo de micro-batching en segundo plano."""
+    global batch_worker
+    if batch_worker is None:
+        batch_worker = threading.Thread(target=_batch_worker_loop, name="batch-worker", daemon=True)
+        batch_worker.start()
+
+def submit_prompt(prompt: str, adaptador=None) -> Future:
+    """Encola un prompt para el worker de micro-batching; su Future devuelve (texto, desglose de tiempos)."""
+    start_batch_worker()
+    futuro = Future()
+    batch_queue.put((prompt, futuro, time.perf_counter(), adaptador))
+    return futuro
+
+def resolver_adaptador(adaptador):
+    """Adaptador efectivo de una petición: el indicado o DEFAULT_ADAPTER. Lanza KeyError si no está cargado."""
+    adaptador = adaptador or DEFAULT_ADAPTER
+    if adaptador is not None and adaptador not in adaptadores:
+        raise KeyError(adaptador)
+    return adaptador
+
+def _extraer_con_metricas(generated_text: str) -> str:
+    """extract_salida midiendo la etapa de extracción y contando los ERROR_PARSING."""
+    inicio = time.perf_counter()
+    salida_absoluta = extract_salida(generated_text)
+    metricas.observar("tlp_etapa_segundos", time.perf_counter() - inicio, etapa="extraccion")
+    if salida_absoluta.startswith("ERROR_PARSING"):
+        metricas.incrementar("tlp_error_parsing_total")
+    return salida_absoluta
+
+def _registrar_ruta(ruta: str, inicio: float, tiempos=None):
+    """Cuenta la petición por ruta y observa su latencia total (y la añade al desglose si se pidió)."""
+    total_s = time.perf_counter() - inicio
+    metricas.incrementar("tlp_peticiones_total", ruta=ruta)
+    metricas.observar("tlp_peticion_segundos", total_s, ruta=ruta)
+    if tiempos is not None:
+        tiempos.update(ruta=ruta, total_s=total_s)
+
+def predict_time(peticion: str, contexto_base: str, tiempos=None, adaptador=None, plazo=None):
+    """
+    Genera la hora absoluta a partir de la petición y el contexto base.
+    'adaptador' elige uno de los adaptadores residentes (por defecto DEFAULT_ADAPTER).
+    'plazo' (instante de time.monotonic) limita la espera al modelo: al vencer se lanza TimeoutError.
+    Si se pasa el dict 'tiempos', se rellena con el desglose por etapas de esta petición.
+    Los errores se devuelven como (mensaje, status HTTP).
+    """
+    inicio = time.perf_counter()
+    try:
+        adaptador = resolver_adaptador(adaptador)
+    except KeyError:
+        return f"Error: Adaptador no cargado: {adaptador}", 404
+
+    # 0. Vía rápida: los patrones conocidos se resuelven sin pasar por el modelo
+    if RULES_FAST_PATH:
+        salida_reglas = resolver_peticion(peticion, contexto_base)
+        if salida_reglas is not None:
+            _registrar_ruta("reglas", inicio, tiempos)
+            return salida_reglas
+
+    # 0b. Caché: misma petición normalizada ya resuelta por el modelo para otro contexto
+    if RESULT_CACHE:
+        salida_cache = cache_tlp.obtener(peticion, contexto_base, adaptador)
+        if salida_cache is not None:
+            _registrar_ruta("cache", inicio, tiempos)
+            return salida_cache
+
+    if model is None or tokenizer is None:
+        return "Error: Modelo no cargado", 503
+
+    # 1. Crear el prompt en el formato TLP del entrenamiento
+    prompt = build_prompt(peticion, contexto_base)
+
+    # 2. Encolar el prompt y esperar a que el worker resuelva su lote
+    futuro = submit_prompt(prompt, adaptador)
+    try:
+        generated_text, tiempos_modelo = futuro.result(
+            timeout=None if plazo is None else max(0.0, plazo - time.monotonic()))
+    except FutureTimeoutError:
+        futuro.cancel() # Si el worker aún no lo ha cogido, ya no se genera
+        raise TimeoutError("Plazo vencido esperando al modelo")
+
+    # 3. Extracción robusta del formato TLP (YYYY-MM-DD HH:MM)
+    inicio_extraccion = time.perf_counter()
+    salida_absoluta = _extraer_con_metricas(generated_text)
+    if tiempos is not None:
+        tiempos.update(tiempos_modelo, extraccion_s=time.perf_counter() - inicio_extraccion)
+    if RESULT_CACHE:
+        cache_tlp.guardar(peticion, contexto_base, salida_absoluta, adaptador)
+    _registrar_ruta("modelo", inicio, tiempos)
+    return salida_absoluta
+
+def _cachear_resultado(item, adaptador, futuro):
+    """Guarda en caché la salida del modelo para un elemento del lote."""
+    if RESULT_CACHE and futuro.exception() is None:
+        cache_tlp.guardar(item['peticion'], item['contexto_base'], extract_salida(futuro.result()[0]), adaptador)
+
+def predict_times(items, adaptador=None):
+    """
+    Resuelve una lista de elementos {'peticion', 'contexto_base'} conservando el orden.
+    Cada elemento puede indicar su 'adaptador'; si no, se usa el de la llamada (o DEFAULT_ADAPTER).
+    Los errores se devuelven por elemento en lugar de hacer fallar toda la llamada.
+    """
+    # 1. Validar y encolar todos los prompts: el worker los agrupa en lotes de BATCH_MAX_SIZE
+    #    (los elementos no válidos llevan su mensaje de error en lugar del Future)
+    pendientes = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('peticion') or not item.get('contexto_base'):
+            pendientes.append((item, "Faltan los campos 'peticion' o 'contexto_base' en el elemento.", None))
+            continue
+        try:
+            adaptador_item = resolver_adaptador(item.get('adaptador') or adaptador)
+        except KeyError as e:
+            pendientes.append((item, f"Adaptador no cargado: {e.args[0]}", None))
+            continue
+        inicio = time.perf_counter()
+        salida_rapida = resolver_peticion(item['peticion'], item['contexto_base']) if RULES_FAST_PATH else None
+        ruta = "reglas"
+        if salida_rapida is None and RESULT_CACHE:
+            salida_rapida = cache_tlp.obtener(item['peticion'], item['contexto_base'], adaptador_item)
+            ruta = "cache"
+        if salida_rapida is not None:
+            _registrar_ruta(ruta, inicio)
+            futuro = Future()
+            futuro.set_result((salida_rapida, None))
+        else:
+            futuro = submit_prompt(build_prompt(item['peticion'], item['contexto_base']), adaptador_item)
+            futuro.add_done_callback(lambda f, item=item, a=adaptador_item: _cachear_resultado(item, a, f))
+        pendientes.append((item, futuro, inicio))
+
+    # 2. Recoger los resultados en el orden de entrada
+    resultados = []
+    for item, futuro, inicio in pendientes:
+        if isinstance(futuro, str):
+            resultados.append({"error": futuro})
+            continue
+        try:
+            texto, tiempos_modelo = futuro.result()
+            salida_absoluta = texto
+            if tiempos_modelo is not None:
+                salida_absoluta = _extraer_con_metricas(texto)
+                # Latencia desde que se encoló el elemento, como en /predict_time
+                _registrar_ruta("modelo", inicio)
+        except Exception as e:
+            resultados.append({"error": f"Error interno del servidor: {str(e)}"})
+            continue
+        resultados.append({
+            "peticion_recibida": item['peticion'],
+            "contexto_base": item['contexto_base'],
+            "salida_absoluta": salida_absoluta
+        })
+    return resultados
     
     # --- Parte 3: El Endpoint de la API y Ejecución ---
 
+def _tiempos_en_ms(tiempos: dict) -> dict:
+    """Pasa las claves '*_s' del desglose a milisegundos para la respuesta de debug."""
+    return {(clave[:-2] + "_ms" if clave.endswith("_s") else clave):
+            (round(valor * 1000, 3) if clave.endswith("_s") else valor)
+            for clave, valor in tiempos.items()}
+
 @app.route('/predict_time', methods=['POST'])
 def predict():
     """Endpoint para recibir la petición JSON y devolver la hora absoluta."""
@@ -94,20 +747,273 @@ def predict():
         if not peticion or not contexto_base:
             return jsonify({"error": "Faltan los campos 'peticion' o 'contexto_base' en el JSON."}), 400
 
-        salida_absoluta = predict_time(peticion, contexto_base)
+        # Desglose de tiempos por etapa sólo si se pide ("debug": true en el JSON o ?debug=1)
+        debug = bool(data.get('debug')) or request.args.get('debug') == '1'
+        tiempos = {} if debug else None
+
+        salida_absoluta = predict_time(peticion, contexto_base, tiempos, data.get('adaptador'))
+        if isinstance(salida_absoluta, tuple):
+            # (mensaje, status): modelo todavía no cargado o adaptador desconocido
+            return jsonify({"error": salida_absoluta[0]}), salida_absoluta[1]
         
         # Devolver el resultado
-        return jsonify({
+        respuesta = {
             "peticion_recibida": peticion,
             "contexto_base": contexto_base,
             "salida_absoluta": salida_absoluta
-        })
+        }
+        if debug:
+            respuesta["tiempos"] = _tiempos_en_ms(tiempos)
+        return jsonify(respuesta)
 
     except Exception as e:
         return jsonify({"error": f"Error interno del servidor: {str(e)}"}), 500
 
+@app.route('/predict_time/batch', methods=['POST'])
+def predict_batch():
+    """Endpoint para resolver en bloque un array JSON de pares (peticion, contexto_base)."""
+    try:
+        data = request.get_json()
+
+        if not isinstance(data, list):
+            return jsonify({"error": "El cuerpo debe ser un array JSON de objetos con 'peticion' y 'contexto_base'."}), 400
+        if len(data) > BATCH_ENDPOINT_MAX_ITEMS:
+            return jsonify({"error": f"Demasiados elementos: máximo {BATCH_ENDPOINT_MAX_ITEMS} por llamada."}), 400
+        if model is None or tokenizer is None:
+            return jsonify({"error": "Error: Modelo no cargado"}), 503
+
+        return jsonify({"resultados": predict_times(data, request.args.get('adaptador'))})
+
+    except Exception as e:
+        return jsonify({"error": f"Error interno del servidor: {str(e)}"}), 500
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: el proceso está vivo y atiende peticiones (aunque el modelo siga cargando)."""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 sólo cuando el modelo está cargado y calentado."""
+    if model_ready.is_set():
+        return jsonify({"status": "ready"})
+    if load_error is not None:
+        return jsonify({"status": "error", "error": load_error}), 503
+    return jsonify({"status": "cargando"}), 503
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Endpoint con los contadores de la caché de resultados (hits/misses/evictions)."""
+    return jsonify(cache_tlp.estadisticas())
+
+def _admin_no_autorizado():
+    """(respuesta, status) si la llamada no puede usar /admin/*, o None si puede."""
+    # El servidor escucha en 0.0.0.0: sin token configurado la administración queda cerrada
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Administración desactivada: define TLP_ADMIN_TOKEN para usar /admin/*."}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return jsonify({"error": "Token de administración no válido."}), 403
+    return None
+
+def _admin_no_disponible():
+    """Motivo (respuesta, status) por el que no se pueden gestionar adaptadores, o None si se puede."""
+    error = _admin_no_autorizado()
+    if error is not None:
+        return error
+    if not BASE_MODEL_PATH:
+        return jsonify({"error": "El servidor usa un modelo fusionado: arranca con --base para usar adaptadores."}), 409
+    if PREFORK_WORKERS > 1:
+        # Cada worker tiene su copia del modelo: un cambio sólo llegaría al worker que atiende la llamada
+        return jsonify({"error": "La gestión de adaptadores en caliente no está disponible en modo pre-fork."}), 409
+    if model is None or tokenizer is None:
+        return jsonify({"error": "Error: Modelo no cargado"}), 503
+    return None
+
+@app.route('/admin/adaptadores', methods=['GET'])
+def listar_adaptadores():
+    """Adaptadores residentes y el que se usa por defecto."""
+    error = _admin_no_autorizado()
+    if error is not None:
+        return error
+    return jsonify({"adaptadores": dict(adaptadores), "defecto": DEFAULT_ADAPTER})
+
+@app.route('/admin/adaptadores', methods=['POST'])
+def anadir_adaptador():
+    """Carga (o recarga) un adaptador en caliente: {"nombre": "...", "ruta": "..."}."""
+    error = _admin_no_disponible()
+    if error is not None:
+        return error
+    data = request.get_json(silent=True) or {}
+    nombre, ruta = data.get('nombre'), data.get('ruta')
+    if not nombre or not ruta:
+        return jsonify({"error": "Faltan los campos 'nombre' o 'ruta' en el JSON."}), 400
+    try:
+        cargar_adaptador(nombre, ruta)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo cargar el adaptador: {str(e)}"}), 400
+    return jsonify({"adaptadores": dict(adaptadores), "defecto": DEFAULT_ADAPTER})
+
+@app.route('/admin/adaptadores/<nombre>', methods=['DELETE'])
+def borrar_adaptador(nombre):
+    """Descarga un adaptador residente (no el de por defecto)."""
+    error = _admin_no_disponible()
+    if error is not None:
+        return error
+    if nombre not in adaptadores:
+        return jsonify({"error": f"Adaptador no cargado: {nombre}"}), 404
+    if nombre == DEFAULT_ADAPTER:
+        return jsonify({"error": "No se puede descargar el adaptador por defecto."}), 409
+    descargar_adaptador(nombre)
+    return jsonify({"adaptadores": dict(adaptadores), "defecto": DEFAULT_ADAPTER})
+
+def metricas_en_vivo():
+    """Gauges que se leen en el momento del scrape: cola del micro-batching y caché de resultados."""
+    gauges = {"tlp_cola_pendientes": batch_queue.qsize()}
+    for clave, valor in cache_tlp.estadisticas().items():
+        gauges[f"tlp_cache_{clave}"] = valor
+    return gauges
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas del hot path en formato de texto de Prometheus."""
+    return Response(metricas.render(metricas_en_vivo()), mimetype="text/plain; version=0.0.4")
+
+def warm_up():
+    """Generación de calentamiento (prefijo, plantilla restringida, kernels) antes de la primera petición real."""
+    inicio = time.perf_counter()
+    generate_batch([build_prompt(WARMUP_PETICION, WARMUP_CONTEXTO)])
+    print(f"Calentamiento completado en {time.perf_counter() - inicio:.2f}s.")
+
+def _prepare_and_warm_up(cargar_modelo: bool = True, self_check_activo: bool = None):
+    """Carga (o termina de preparar) el modelo, lo calienta y marca el servidor como listo."""
+    global load_error
+    if self_check_activo is None:
+        self_check_activo = SELF_CHECK
+    try:
+        if cargar_modelo:
+            load_model()
+        elif PREFIX_KV_CACHE:
+            prepare_prefix_cache()
+        if self_check_activo:
+            self_check()
+        warm_up()
+        start_batch_worker()
+        model_ready.set()
+        print("Modelo listo: /readyz responde 200.")
+    except Exception as e:
+        load_error = str(e)
+        print(f"Error cargando el modelo: {load_error}")
+
+def start_background_loading(cargar_modelo: bool = True, self_check_activo: bool = None):
+    """Prepara el modelo en un hilo para que el servidor acepte conexiones (y /healthz) desde el arranque."""
+    hilo = threading.Thread(target=_prepare_and_warm_up, args=(cargar_modelo, self_check_activo),
+                            name="carga-modelo", daemon=True)
+    hilo.start()
+    return hilo
+
+def _prefork_worker(sock, indice, hilos):
+    """Cuerpo de cada worker pre-fork: su propio presupuesto de hilos, prefijo y micro-batching."""
+    configurar_hilos_worker(hilos)
+    start_background_loading(cargar_modelo=False, self_check_activo=SELF_CHECK and indice == 0)
+
+    servidor = make_server('0.0.0.0', PORT, app, threaded=True, fd=sock.fileno())
+    print(f"Worker {indice} (pid {os.getpid()}) listo con {hilos} hilos.")
+    servidor.serve_forever()
+
+def serve_prefork(num_workers: int, hilos: int):
+    """Hace fork de N workers que comparten los pesos ya cargados y el mismo socket de escucha."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', PORT))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    hijos = []
+    for indice in range(num_workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _prefork_worker(sock, indice, hilos)
+            finally:
+                os._exit(0)
+        hijos.append(pid)
+
+    vivos = set(hijos)
+
+    def _terminar(signum, frame):
+        # Sólo reenvía la señal: el bucle principal espera a los workers y termina con normalidad
+        for pid in vivos:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _terminar)
+    signal.signal(signal.SIGINT, _terminar)
+    print(f"\nServidor pre-fork con {num_workers} workers escuchando en el puerto {PORT}.")
+    while vivos:
+        try:
+            pid, _ = os.wait() # Se reintenta tras cada señal (PEP 475)
+        except ChildProcessError:
+            break
+        vivos.discard(pid)
+    sock.close()
+    print("Workers terminados, servidor pre-fork detenido.")
+
+def parse_args():
+    """Opciones de línea de comandos para elegir la configuración de inferencia por máquina."""
+    parser = argparse.ArgumentParser(description="Servidor local de predicción TLP.")
+    parser.add_argument("--cpu-backend", choices=["float32", "int8", *MODELOS_ONNX], default=CPU_BACKEND)
+    parser.add_argument("--threads", type=int, default=CPU_NUM_THREADS, help="Hilos intra-op de torch.")
+    parser.add_argument("--interop-threads", type=int, default=CPU_INTEROP_THREADS, help="Hilos inter-op de torch.")
+    parser.add_argument("--compile", action="store_true", default=TORCH_COMPILE, help="Usa torch.compile.")
+    parser.add_argument("--no-self-check", action="store_true", help="No mide tokens/s al arrancar.")
+    parser.add_argument("--self-check-only", action="store_true", help="Mide tokens/s y sale sin servir.")
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS,
+                        help="Procesos worker que comparten el modelo (pre-fork, sólo Unix).")
+    parser.add_argument("--base", default=BASE_MODEL_PATH,
+                        help="Modelo base para servir adaptadores LoRA (en lugar del modelo fusionado).")
+    parser.add_argument("--adaptador", action="append", default=[], metavar="NOMBRE=RUTA",
+                        help="Adaptador que se carga al arrancar (se puede repetir; requiere --base).")
+    parser.add_argument("--adaptador-defecto", default=DEFAULT_ADAPTER,
+                        help="Adaptador de las peticiones que no indican ninguno.")
+    parser.add_argument("--sin-reglas", action="store_true", help="Desactiva la vía rápida de reglas (todo al modelo).")
+    parser.add_argument("--sin-cache", action="store_true", help="Desactiva la caché de resultados.")
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    # Cargar el modelo ANTES de arrancar el servidor
-    load_model()
-    print("\nServidor listo para recibir peticiones POST en /predict_time.")
-    app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
+    args = parse_args()
+    CPU_BACKEND = args.cpu_backend
+    CPU_NUM_THREADS = args.threads
+    CPU_INTEROP_THREADS = args.interop_threads
+    TORCH_COMPILE = args.compile
+    SELF_CHECK = not args.no_self_check
+    PREFORK_WORKERS = args.workers
+    BASE_MODEL_PATH = args.base
+    ADAPTERS = dict(ADAPTERS, **dict(a.split("=", 1) for a in args.adaptador))
+    DEFAULT_ADAPTER = args.adaptador_defecto
+    RULES_FAST_PATH = RULES_FAST_PATH and not args.sin_reglas
+    RESULT_CACHE = RESULT_CACHE and not args.sin_cache
+    if ADAPTERS and not BASE_MODEL_PATH:
+        raise SystemExit("--adaptador requiere --base (el modelo fusionado ya incluye su adaptador).")
+    if DEFAULT_ADAPTER is not None and DEFAULT_ADAPTER not in ADAPTERS:
+        raise SystemExit(f"--adaptador-defecto '{DEFAULT_ADAPTER}' no está entre los adaptadores cargados.")
+
+    if PREFORK_WORKERS > 1 and not args.self_check_only:
+        # Reparto de núcleos para que los workers no compitan por los mismos hilos
+        hilos_worker = CPU_NUM_THREADS or max(1, (os.cpu_count() or 1) // PREFORK_WORKERS)
+        # El padre sólo carga pesos: un único hilo evita arrancar pools de OpenMP antes del fork
+        CPU_NUM_THREADS = 1
+        load_model(prefill_prefix=False)
+        serve_prefork(PREFORK_WORKERS, hilos_worker)
+        raise SystemExit(0)
+
+    if args.self_check_only:
+        load_model()
+        self_check()
+        raise SystemExit(0)
+
+    # El modelo se carga en segundo plano: /healthz responde ya, /readyz cuando esté calentado
+    start_background_loading()
+    print("\nServidor aceptando conexiones: POST /predict_time y /predict_time/batch (ver /readyz y /metrics).")
+    app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
\ No newline at end of file
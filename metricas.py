@@ -0,0 +1,86 @@
+import threading
+
+# Métricas del servidor en formato de texto de Prometheus (sin depender de prometheus_client).
+# Contadores, gauges e histogramas se guardan por (nombre, etiquetas) en memoria del proceso.
+
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_BATCH = (1, 2, 4, 8, 16, 32, 64)
+
+# Estado global de las métricas
+_lock = threading.Lock()
+_descripciones = {}   # nombre -> (tipo, ayuda)
+_contadores = {}      # (nombre, etiquetas) -> valor
+_gauges = {}          # (nombre, etiquetas) -> valor
+_histogramas = {}     # (nombre, etiquetas) -> {"buckets": [...], "cuentas": [...], "suma": x, "cuenta": n}
+
+
+def describir(nombre: str, tipo: str, ayuda: str):
+    """Registra el tipo ('counter', 'gauge', 'histogram') y el texto de ayuda de una métrica."""
+    _descripciones[nombre] = (tipo, ayuda)
+
+
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted(etiquetas.items()))
+
+
+def incrementar(nombre: str, valor: float = 1, **etiquetas):
+    with _lock:
+        clave = _clave(nombre, etiquetas)
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def fijar(nombre: str, valor: float, **etiquetas):
+    with _lock:
+        _gauges[_clave(nombre, etiquetas)] = valor
+
+
+def observar(nombre: str, valor: float, buckets=BUCKETS_SEGUNDOS, **etiquetas):
+    with _lock:
+        clave = _clave(nombre, etiquetas)
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = {"buckets": buckets, "cuentas": [0] * len(buckets), "suma": 0.0, "cuenta": 0}
+            _histogramas[clave] = histograma
+        for i, limite in enumerate(histograma["buckets"]):
+            if valor <= limite:
+                histograma["cuentas"][i] += 1
+        histograma["suma"] += valor
+        histograma["cuenta"] += 1
+
+
+def _etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+
+def render(gauges_extra=None) -> str:
+    """Texto de exposición de Prometheus. 'gauges_extra' son gauges calculados en el momento ({nombre: valor})."""
+    lineas = []
+    with _lock:
+        gauges = dict(_gauges)
+        for nombre, valor in (gauges_extra or {}).items():
+            gauges[(nombre, ())] = valor
+        series = [(clave, "counter", valor) for clave, valor in _contadores.items()]
+        series += [(clave, "gauge", valor) for clave, valor in gauges.items()]
+        series += [(clave, "histogram", dict(h, cuentas=list(h["cuentas"]))) for clave, h in _histogramas.items()]
+
+    vistos = set()
+    for (nombre, etiquetas), tipo, valor in sorted(series, key=lambda s: s[0]):
+        if nombre not in vistos:
+            vistos.add(nombre)
+            tipo_declarado, ayuda = _descripciones.get(nombre, (tipo, ""))
+            if ayuda:
+                lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo_declarado}")
+
+        if tipo != "histogram":
+            lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor}")
+            continue
+        for limite, cuenta in zip(valor["buckets"], valor["cuentas"]):
+            lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, [('le', limite)])} {cuenta}")
+        lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, [('le', '+Inf')])} {valor['cuenta']}")
+        lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {valor['suma']}")
+        lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {valor['cuenta']}")
+    return "\n".join(lineas) + "\n"
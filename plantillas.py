@@ -0,0 +1,52 @@
+import json
+
+# Plantillas de prompt compartidas por el entrenamiento (train.py), la evaluación (test.py)
+# y el servidor (local_api_server.py), para que el modelo vea en producción exactamente el mismo texto
+# con el que se entrenó. Cada tarea separa el prompt de la respuesta: la loss sólo se calcula
+# sobre los tokens de la respuesta.
+PLANTILLAS = {
+    # datos_horas*.jsonl: {"instruction": "...", "output": "23:25"}
+    "hora": {
+        "prompt": "Instrucción: {instruction}\nRespuesta:",
+        "respuesta": " {output}",
+    },
+    # datos_horas_tlp*.jsonl: {"peticion": "...", "contexto_base": "...", "salida_absoluta": "..."}
+    "tlp": {
+        "prompt": "Contexto_AHORA: {contexto_base}\nPeticion_Usuario: {peticion}\nSalida_ABSOLUTA:",
+        "respuesta": " {salida_absoluta}",
+    },
+}
+
+# Campos que identifican cada tarea en una fila del JSONL
+CAMPOS_TAREA = {
+    "hora": ("instruction", "output"),
+    "tlp": ("peticion", "contexto_base", "salida_absoluta"),
+}
+
+# Parte fija al inicio del prompt TLP (local_api_server.py precalcula su KV cache)
+PREFIJO_TLP = PLANTILLAS["tlp"]["prompt"].split("{", 1)[0]
+
+
+def formatear_prompt(tarea: str, **campos) -> str:
+    return PLANTILLAS[tarea]["prompt"].format(**campos)
+
+
+def formatear_respuesta(tarea: str, **campos) -> str:
+    return PLANTILLAS[tarea]["respuesta"].format(**campos)
+
+
+def tarea_de(fila: dict) -> str:
+    """Tarea de una fila según sus campos."""
+    for tarea, campos in CAMPOS_TAREA.items():
+        if all(campo in fila for campo in campos):
+            return tarea
+    raise ValueError(f"Fila sin los campos de ninguna tarea conocida: {sorted(fila)}")
+
+
+def tarea_de_fichero(path: str) -> str:
+    """Tarea de un JSONL según su primera fila."""
+    with open(path, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                return tarea_de(json.loads(linea))
+    raise ValueError(f"Fichero vacío: {path}")
@@ -0,0 +1,151 @@
+import re
+import importlib
+from datetime import datetime, timedelta
+from frases_hora import DIAS_SEMANA_ES, DIAS_HASTA, NUMEROS, FRASES_TLP, MINUTOS_DIA
+
+# Las tablas del generador TLP y de frases_hora.py son la fuente de verdad de las frases que resolvemos aquí.
+# El nombre del fichero lleva tilde, así que se importa por nombre.
+_gen_tlp = importlib.import_module("generarDatasetConDías")
+
+EXPRESIONES_RELATIVAS = _gen_tlp.EXPRESIONES_RELATIVAS
+EXPRESIONES_PARTE_DIA = _gen_tlp.EXPRESIONES_PARTE_DIA
+
+FORMATO_TLP = "%Y-%m-%d %H:%M"
+
+# --- TABLAS INVERSAS (se construyen una sola vez al importar) ---
+
+# Texto -> número (inverso de frases_hora.NUMEROS), más las formas femeninas/apocopadas
+NUMEROS_TEXTO = {NUMEROS[n]: n for n in range(1, 60)}
+NUMEROS_TEXTO.update({"un": 1, "una": 1})
+
+# Texto de hora -> (HH, MM) para los 1440 minutos del día (inverso de frases_hora.FRASES_TLP)
+HORAS_TEXTO = {}
+for _minuto in range(MINUTOS_DIA):
+    HORAS_TEXTO.setdefault(FRASES_TLP[_minuto], (_minuto // 60, _minuto % 60))
+
+# --- REGLAS COMPILADAS ---
+_NUM = "|".join(sorted(map(re.escape, NUMEROS_TEXTO), key=len, reverse=True))
+
+RE_RELATIVA = re.compile(r"\bdentro de (?P<expresion>.+)$")
+RE_RELATIVA_LIBRE = re.compile(
+    rf"^(?P<cantidad>{_NUM}) (?P<unidad>horas?|minutos?)"
+    rf"(?: y (?:(?P<media>media)|(?P<cuarto>cuarto)|(?P<minutos>{_NUM}) minutos?))?$"
+)
+RE_PARTE_DIA = re.compile(
+    r"\b(?P<expresion>" + "|".join(map(re.escape, EXPRESIONES_PARTE_DIA)) + r")$"
+)
+RE_DIA_HORA = re.compile(
+    r"\b(?P<dia>pasado mañana|(?<!esta )(?<!la )mañana|el (?:" + "|".join(DIAS_SEMANA_ES) + r")) a las (?P<hora>.+)$"
+)
+# Otra referencia de día o parte del día delante de "<día> a las ...": la petición es ambigua para las reglas
+# ("el viernes por la mañana a las diez", "esta mañana a las nueve") y se deja al modelo
+RE_OTRO_DIA = re.compile(
+    r"\b(?:hoy|mañana|tarde|noche|madrugada|mediodía|" + "|".join(DIAS_SEMANA_ES) + r")\b"
+)
+
+# Peticiones que las reglas no deben resolver (o deben resolver así): (petición, contexto_base, salida o None)
+CASOS_REGRESION = [
+    ("Quiero un taxi esta mañana a las nueve en punto de la mañana", "2025-01-06 06:00", None),
+    ("Necesito un taxi el viernes por la mañana a las diez en punto de la mañana", "2025-01-06 06:00", None),
+    ("Quiero reservar un taxi para **mañana a las nueve en punto de la mañana**.", "2025-01-06 06:00", "2025-01-07 09:00"),
+    ("Quiero reservar un taxi para **el viernes a las diez en punto de la mañana**.", "2025-01-06 06:00", "2025-01-10 10:00"),
+]
+
+
+def normalizar_peticion(peticion: str) -> str:
+    """Minúsculas, sin marcado '**', sin puntuación final y con espacios colapsados."""
+    texto = peticion.lower().replace("**", "")
+    texto = " ".join(texto.split())
+    return texto.rstrip(" .!?¡¿,;")
+
+
+def _delta_relativo(expresion: str):
+    """Convierte 'una hora y media', 'cuarenta minutos', ... en un timedelta (o None)."""
+    if expresion in EXPRESIONES_RELATIVAS:
+        return EXPRESIONES_RELATIVAS[expresion]
+
+    match = RE_RELATIVA_LIBRE.match(expresion)
+    if not match:
+        return None
+
+    cantidad = NUMEROS_TEXTO[match.group("cantidad")]
+    minutos = cantidad * 60 if match.group("unidad").startswith("hora") else cantidad
+    if match.group("media"):
+        minutos += 30
+    elif match.group("cuarto"):
+        minutos += 15
+    elif match.group("minutos"):
+        minutos += NUMEROS_TEXTO[match.group("minutos")]
+    return timedelta(minutes=minutos)
+
+
+def dias_hasta(modificador_dia: str, base: datetime) -> int:
+    """Días desde el contexto hasta 'mañana', 'pasado mañana' o 'el <día de la semana>'."""
+    return DIAS_HASTA[modificador_dia][base.weekday()]
+
+
+def categoria_peticion(peticion: str) -> str:
+    """Categoría de la petición según los casos del generador TLP (para informes de evaluación)."""
+    texto = normalizar_peticion(peticion)
+    if RE_RELATIVA.search(texto):
+        return "relativa"
+    match = RE_DIA_HORA.search(texto)
+    if match and not RE_OTRO_DIA.search(texto[:match.start()]):
+        return "dia_semana" if match.group("dia").startswith("el ") else match.group("dia")
+    if RE_PARTE_DIA.search(texto):
+        return "parte_dia"
+    return "otra"
+
+
+def resolver_peticion(peticion: str, contexto_base: str):
+    """
+    Resuelve de forma determinista las peticiones con los patrones del generador TLP.
+    Devuelve 'YYYY-MM-DD HH:MM' o None si ninguna regla encaja (hay que usar el modelo).
+    """
+    try:
+        base = datetime.strptime(contexto_base, FORMATO_TLP)
+    except ValueError:
+        return None
+
+    texto = normalizar_peticion(peticion)
+
+    # CASO 1: Referencia relativa ("dentro de una hora y media")
+    match = RE_RELATIVA.search(texto)
+    if match:
+        delta = _delta_relativo(match.group("expresion"))
+        return (base + delta).strftime(FORMATO_TLP) if delta is not None else None
+
+    # CASO 2: Día específico + hora en texto ("el jueves a las ocho y media de la tarde")
+    match = RE_DIA_HORA.search(texto)
+    if match:
+        hora = HORAS_TEXTO.get(match.group("hora"))
+        if hora is None or RE_OTRO_DIA.search(texto[:match.start()]):
+            return None
+        fecha = base + timedelta(days=dias_hasta(match.group("dia"), base))
+        return fecha.replace(hour=hora[0], minute=hora[1]).strftime(FORMATO_TLP)
+
+    # CASO 3: Parte del día ("esta noche")
+    match = RE_PARTE_DIA.search(texto)
+    if match:
+        return EXPRESIONES_PARTE_DIA[match.group("expresion")](base).strftime(FORMATO_TLP)
+
+    return None
+
+
+def comprobar_casos():
+    """Comprueba CASOS_REGRESION; devuelve la lista de fallos (petición, esperado, obtenido)."""
+    fallos = []
+    for peticion, contexto_base, esperado in CASOS_REGRESION:
+        obtenido = resolver_peticion(peticion, contexto_base)
+        if obtenido != esperado:
+            fallos.append((peticion, esperado, obtenido))
+    return fallos
+
+
+if __name__ == "__main__":
+    fallos = comprobar_casos()
+    for peticion, esperado, obtenido in fallos:
+        print(f"FALLO {peticion!r}: esperado {esperado!r}, obtenido {obtenido!r}")
+    print(f"{len(CASOS_REGRESION) - len(fallos)}/{len(CASOS_REGRESION)} casos de regresión correctos.")
+    if fallos:
+        raise SystemExit(1)
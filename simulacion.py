@@ -4,6 +4,7 @@ from flask import Flask, request, jsonify
 
 app = Flask(__name__)
 PORT = 5000 
+BATCH_ENDPOINT_MAX_ITEMS = 1000  # Mismo límite que /predict_time/batch en local_api_server.py
 
 def mock_predict_time(peticion: str, contexto_base_str: str) -> str:
     """
@@ -80,8 +81,38 @@ def predict():
     except Exception as e:
         return jsonify({"error": f"Error interno del servidor: {str(e)}"}), 500
 
+@app.route('/predict_time/batch', methods=['POST'])
+def predict_batch():
+    """Endpoint en bloque: mismo contrato que /predict_time/batch del servidor real."""
+    try:
+        data = request.get_json()
+
+        if not isinstance(data, list):
+            return jsonify({"error": "El cuerpo debe ser un array JSON de objetos con 'peticion' y 'contexto_base'."}), 400
+        if len(data) > BATCH_ENDPOINT_MAX_ITEMS:
+            return jsonify({"error": f"Demasiados elementos: máximo {BATCH_ENDPOINT_MAX_ITEMS} por llamada."}), 400
+
+        resultados = []
+        for item in data:
+            if not isinstance(item, dict) or not item.get('peticion') or not item.get('contexto_base'):
+                resultados.append({"error": "Faltan los campos 'peticion' o 'contexto_base' en el elemento."})
+                continue
+            resultados.append({
+                "peticion_recibida": item['peticion'],
+                "contexto_base": item['contexto_base'],
+                "salida_absoluta": mock_predict_time(item['peticion'], item['contexto_base'])
+            })
+
+        return jsonify({
+            "resultados": resultados,
+            "simulacion": "ESTA RESPUESTA ES MOCK Y NO USA EL MODELO QWEN"
+        })
+
+    except Exception as e:
+        return jsonify({"error": f"Error interno del servidor: {str(e)}"}), 500
+
 if __name__ == '__main__':
-    print("Servidor Mock listo para recibir peticiones POST en /predict_time.")
+    print("Servidor Mock listo para recibir peticiones POST en /predict_time y /predict_time/batch.")
     # Usar host='0.0.0.0' para asegurar acceso si estás usando contenedores/VMs
     app.run(host='0.0.0.0', port=PORT, debug=False)
 # ---------------------------------------------------
\ No newline at end of file
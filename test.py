@@ -1,13 +1,28 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
 import torch
-from datasets import load_dataset
 from peft import LoraConfig, AutoPeftModelForCausalLM, get_peft_model, PeftModel
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments, BitsAndBytesConfig
+from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments, BitsAndBytesConfig, LogitsProcessorList
 from trl import SFTTrainer
+import pandas as pd
 from pandas import DataFrame
+from decodificacion import ProcesadorFormato, PLANTILLA_HORA, max_new_tokens_para
+from dataset_tokenizado import cargar_tarea
+from plantillas import formatear_prompt
 
 MODEL_ID = "Qwen/Qwen1.5-1.8B-Chat"
 PEFT_ADAPTERS_PATH = "qwen_hora_final"
 TEST_DATASET_FILE = "datos_horas_test_random.jsonl"
+TLP_TEST_DATASET_FILE = "datos_horas_tlp_v4_test.jsonl" # Apartado del entrenamiento (generarDatasetConDías.py --test)
+# Ficheros con los que se entrenan los modelos: evaluar con ellos da una precisión inflada
+TRAIN_DATASET_FILES = ["datos_horas.jsonl", "datos_horas_tlp_v4.jsonl"]
+CONSTRAINED_DECODING = False # Restringe la salida a HH:MM (decodificacion.py)
+EVAL_BATCH_SIZE = 32 # Ejemplos por llamada a generate (ordenados por longitud para minimizar el padding)
+EVAL_CPU_PROCESSES = 2 # Procesos en CPU; cada uno carga su propia copia del modelo (ojo con la RAM)
+LOTE_LECTURA = 1000 # Filas por lectura del dataset Arrow al calcular las longitudes
 
 def load_peft_model_for_inference(model_id, peft_path):
     print("Cargando modelo y tokenizer...")
@@ -17,15 +32,20 @@ def load_peft_model_for_inference(model_id, peft_path):
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
     tokenizer.padding_side = "left"
-    bnb_config = torch.quantization.QuantStub()
 
-    base_model = AutoModelForCausalLM.from_pretrained(
-        model_id,
-        quantization_config=BitsAndBytesConfig(
+    # 4 bits (bitsandbytes) sólo en GPU; en CPU se evalúa en float32
+    quantization_config = None
+    if device == "cuda":
+        quantization_config = BitsAndBytesConfig(
             load_in_4bit=True,
             bnb_4bit_quant_type="nf4",
             bnb_4bit_compute_dtype=torch.bfloat16
-        ),
+        )
+
+    base_model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        quantization_config=quantization_config,
+        torch_dtype=None if device == "cuda" else torch.float32,
         device_map=device
     )
 
@@ -34,49 +54,124 @@ def load_peft_model_for_inference(model_id, peft_path):
     print(f"Modelo cargado")
     return model_with_peft, tokenizer, device
 
-def generar_hora_digital(instruction: str, modelo, tokenizador):
-    prompt = f"{instruction}\nRespuesta:"
+def _limpiar_respuesta(generated_text: str) -> str:
+    respuesta_limpia = generated_text.split('\n')[0].strip()
+    if "Respuesta:" in respuesta_limpia:
+        respuesta_limpia = respuesta_limpia.split("Respuesta:")[1].strip()
+    return respuesta_limpia
+
+def generar_horas_digitales(instructions, modelo, tokenizador, restringido: bool = False, input_ids=None):
+    """
+    Versión por lotes de generar_hora_digital: un único generate con padding a la izquierda.
+    Si se pasan 'input_ids' (prompts ya tokenizados) sólo se rellenan, sin volver a tokenizar ('instructions' no se usa).
+    """
+    if input_ids is None:
+        prompts = [formatear_prompt("hora", instruction=instruction) for instruction in instructions]
+        inputs = tokenizador(prompts, return_tensors="pt", padding=True)
+    else:
+        inputs = tokenizador.pad({"input_ids": input_ids}, return_tensors="pt")
+    inputs = inputs.to(modelo.device)
+    prompt_len = inputs['input_ids'].shape[1]
 
-    inputs = tokenizador(prompt, return_tensors="pt", padding=True).to(modelo.device)
+    logits_processor = None
+    max_new_tokens = 10
+    if restringido:
+        logits_processor = LogitsProcessorList([ProcesadorFormato(tokenizador, PLANTILLA_HORA, prompt_len)])
+        max_new_tokens = max_new_tokens_para(PLANTILLA_HORA)
 
     with torch.no_grad():
         output_tokens = modelo.generate(
             **inputs,
-            max_new_tokens=10,
+            max_new_tokens=max_new_tokens,
+            logits_processor=logits_processor,
             do_sample=False,
-            eos_token_id=tokenizador.eos_token_id
+            eos_token_id=tokenizador.eos_token_id,
+            pad_token_id=tokenizador.pad_token_id
         )
 
-    generated_text = tokenizador.decode(output_tokens[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
-    respuesta_limpia = generated_text.split('\n')[0].strip()
-    if "Respuesta:" in respuesta_limpia:
-        respuesta_limpia = respuesta_limpia.split("Respuesta:")[1].strip()
+    generated_texts = tokenizador.batch_decode(output_tokens[:, prompt_len:], skip_special_tokens=True)
+    return [_limpiar_respuesta(text) for text in generated_texts]
 
-    return respuesta_limpia
+def generar_hora_digital(instruction: str, modelo, tokenizador, restringido: bool = False):
+    return generar_horas_digitales([instruction], modelo, tokenizador, restringido)[0]
 
+def predecir_por_lotes(dataset, modelo, tokenizador, batch_size=EVAL_BATCH_SIZE, restringido=False):
+    """
+    Predice los ejemplos del dataset pre-tokenizado (cargar_tarea) ordenados por longitud y devuelve las
+    respuestas en el orden original. Los input_ids se leen del Arrow por lotes en formato torch, sin
+    convertir la columna entera en listas de Python.
+    """
+    ids = dataset.with_format("torch", columns=["input_ids"])
+    longitudes = [len(fila) for lote in ids.iter(batch_size=LOTE_LECTURA) for fila in lote["input_ids"]]
+    orden = sorted(range(len(dataset)), key=lambda i: longitudes[i])
 
-def evaluate_model():
-    from transformers import BitsAndBytesConfig
-    model_with_peft, tokenizer, device = load_peft_model_for_inference(MODEL_ID, PEFT_ADAPTERS_PATH)
+    predicciones = [None] * len(dataset)
+    for inicio in range(0, len(orden), batch_size):
+        lote = orden[inicio:inicio + batch_size]
+        respuestas = generar_horas_digitales(None, modelo, tokenizador, restringido, ids[lote]["input_ids"])
+        for i, respuesta in zip(lote, respuestas):
+            predicciones[i] = respuesta.strip()
+        print(f"Procesado: {min(inicio + batch_size, len(orden))}/{len(orden)}")
+    return predicciones
 
-    try:
-        test_dataset = load_dataset("json", data_files=TEST_DATASET_FILE, split="train")
-        print(f"Dataset de prueba cargado con {len(test_dataset)} ejemplos.")
-    except FileNotFoundError:
+def _evaluar_shard(args):
+    """Worker de CPU: carga su propia copia del modelo y predice su parte del test."""
+    shard, hilos = args
+    torch.set_num_threads(hilos)
+    modelo, tokenizador, _ = load_peft_model_for_inference(MODEL_ID, PEFT_ADAPTERS_PATH)
+    return predecir_por_lotes(shard, modelo, tokenizador, EVAL_BATCH_SIZE, CONSTRAINED_DECODING)
+
+def predecir_en_paralelo(dataset, num_procesos):
+    """Reparte el dataset entre procesos (filas intercaladas para equilibrar longitudes) y junta el resultado."""
+    hilos = max(1, (os.cpu_count() or 1) // num_procesos)
+    # Cada shard es una vista del mismo Arrow mapeado: al proceso sólo viaja la ruta y los índices
+    shards = [(dataset.shard(num_procesos, i, contiguous=False), hilos) for i in range(num_procesos)]
+    with multiprocessing.get_context("spawn").Pool(num_procesos) as pool:
+        resultados = pool.map(_evaluar_shard, shards)
+
+    predicciones = [None] * len(dataset)
+    for i, resultado in enumerate(resultados):
+        predicciones[i::num_procesos] = resultado
+    return predicciones
+
+def avisar_si_es_entrenamiento(dataset_file):
+    """Avisa si el fichero de evaluación es uno de los de entrenamiento (la precisión no sería representativa)."""
+    ruta = os.path.abspath(dataset_file)
+    if any(ruta == os.path.abspath(fichero) for fichero in TRAIN_DATASET_FILES):
+        print(f"AVISO: {dataset_file} es un fichero de entrenamiento; la precisión no mide la generalización.")
+
+def cargar_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def evaluate_model():
+    if not os.path.exists(TEST_DATASET_FILE):
         print(f"Error: No se encontró el archivo de prueba: {TEST_DATASET_FILE}. Asegúrate de ejecutar 'generate_test_dataset.py' primero.")
         return
+    avisar_si_es_entrenamiento(TEST_DATASET_FILE)
+
+    # Los prompts se tokenizan una vez y se reutilizan (caché en memoria mapeada) en las siguientes evaluaciones
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+    test_dataset = cargar_tarea(TEST_DATASET_FILE, tokenizer, "hora", con_respuesta=False)
+    print(f"Dataset de prueba cargado con {len(test_dataset)} ejemplos.")
 
-    resultados = []
-    correctos = 0
     total = len(test_dataset)
 
     print("\nIniciando evaluación...")
-    for i, ejemplo in enumerate(test_dataset):
+    num_procesos = min(EVAL_CPU_PROCESSES, total) if not torch.cuda.is_available() else 1
+    if num_procesos > 1:
+        predicciones = predecir_en_paralelo(test_dataset, num_procesos)
+    else:
+        model_with_peft, tokenizer, device = load_peft_model_for_inference(MODEL_ID, PEFT_ADAPTERS_PATH)
+        predicciones = predecir_por_lotes(test_dataset, model_with_peft, tokenizer, EVAL_BATCH_SIZE, CONSTRAINED_DECODING)
+
+    resultados = []
+    correctos = 0
+    for ejemplo, predicted_output in zip(test_dataset.select_columns(['instruction', 'output']), predicciones):
         instruction = ejemplo['instruction']
         expected_output = ejemplo['output'].strip()
 
-        predicted_output = generar_hora_digital(instruction, model_with_peft, tokenizer).strip()
-
         es_correcto = (predicted_output == expected_output)
         if es_correcto:
             correctos += 1
@@ -88,9 +183,6 @@ def evaluate_model():
             "Correcto": "Correcto" if es_correcto else "Incorrecto"
         })
 
-        if (i + 1) % 20 == 0 or (i + 1) == total:
-            print(f"Procesado: {i + 1}/{total}")
-
     accuracy = (correctos / total) * 100
 
     print("\n" + "="*50)
@@ -100,12 +192,14 @@ def evaluate_model():
     print(f"Precisión (Accuracy): {accuracy:.2f}%")
     print("="*50)
 
-    df_resultados = DataFrame(resultados)
+    imprimir_fallos(DataFrame(resultados), ['Entrada', 'Esperado', 'Predicho', 'Correcto'])
+
+def imprimir_fallos(df_resultados, columnas):
     df_fallas = df_resultados[df_resultados['Correcto'] == 'Incorrecto']
 
     if not df_fallas.empty:
         print("\n--- EJEMPLOS FALLIDOS (para análisis) ---")
-        df_display = df_fallas[['Entrada', 'Esperado', 'Predicho', 'Correcto']]
+        df_display = df_fallas[columnas]
         with pd.option_context('display.max_colwidth', None,
                                'display.width', 1000,
                                'display.max_rows', None):
@@ -116,6 +210,103 @@ def evaluate_model():
         print("\nEl modelo acertó en todos los ejemplos de prueba")
 
 
+def evaluate_tlp(dataset_file=TLP_TEST_DATASET_FILE, batch_size=1, limite=None):
+    """
+    Evalúa el modelo fusionado en formato TLP con el mismo prompt y generación que local_api_server.
+    Informa precisión por categoría de petición, tokens/s y latencia p50/p95/p99 por ejemplo.
+    Con batch_size=1 la latencia es la de una petición aislada al servidor.
+    """
+    import local_api_server as servidor
+    from reglas_tlp import categoria_peticion
+
+    try:
+        test_dataset = cargar_jsonl(dataset_file)[:limite]
+        print(f"Dataset TLP cargado con {len(test_dataset)} ejemplos.")
+    except FileNotFoundError:
+        print(f"Error: No se encontró el archivo de prueba: {dataset_file}. Genéralo con 'generarDatasetConDías.py --test N'.")
+        return
+    avisar_si_es_entrenamiento(dataset_file)
+
+    servidor.load_model()
+    prompts = [servidor.build_prompt(e['peticion'], e['contexto_base']) for e in test_dataset]
+    total = len(test_dataset)
+
+    # Calentamiento para que la primera latencia no incluya la inicialización
+    servidor.generate_batch(prompts[:1])
+
+    print("\nIniciando evaluación TLP...")
+    longitudes = [len(ids) for ids in servidor.tokenizer(prompts)['input_ids']]
+    orden = sorted(range(total), key=lambda i: longitudes[i])
+    predicciones = [None] * total
+    latencias_ms = [None] * total
+    tokens_generados = 0
+    tiempo_generacion = 0.0
+
+    for inicio in range(0, total, batch_size):
+        lote = orden[inicio:inicio + batch_size]
+        stats = {}
+        t0 = time.perf_counter()
+        textos = servidor.generate_batch([prompts[i] for i in lote], stats)
+        duracion = time.perf_counter() - t0
+
+        tiempo_generacion += duracion
+        tokens_generados += sum(stats["tokens_generados"])
+        for i, texto in zip(lote, textos):
+            predicciones[i] = servidor.extract_salida(texto)
+            latencias_ms[i] = duracion * 1000
+
+        if (inicio + len(lote)) // 100 > inicio // 100 or inicio + len(lote) == total:
+            print(f"Procesado: {inicio + len(lote)}/{total}")
+
+    resultados = []
+    for ejemplo, predicho, latencia in zip(test_dataset, predicciones, latencias_ms):
+        esperado = ejemplo['salida_absoluta'].strip()
+        resultados.append({
+            "Categoria": categoria_peticion(ejemplo['peticion']),
+            "Contexto": ejemplo['contexto_base'],
+            "Entrada": ejemplo['peticion'],
+            "Esperado": esperado,
+            "Predicho": predicho,
+            "Correcto": "Correcto" if predicho == esperado else "Incorrecto",
+            "Latencia_ms": latencia,
+        })
+
+    df_resultados = DataFrame(resultados)
+    df_resultados['Acierto'] = df_resultados['Correcto'] == 'Correcto'
+    correctos = int(df_resultados['Acierto'].sum())
+    percentiles = df_resultados['Latencia_ms'].quantile([0.5, 0.95, 0.99])
+
+    print("\n" + "="*50)
+    print(f"RESULTADOS TLP EN {dataset_file} ({total} ejemplos, batch {batch_size})")
+    print("="*50)
+    print(f"Total Correctos: {correctos}")
+    print(f"Precisión (Accuracy): {correctos / total * 100:.2f}%")
+    print("\nPrecisión por categoría:")
+    por_categoria = df_resultados.groupby('Categoria')['Acierto'].agg(['count', 'sum', 'mean'])
+    for categoria, fila in por_categoria.iterrows():
+        print(f"  {categoria:<15} {int(fila['sum']):>6}/{int(fila['count']):<6} {fila['mean'] * 100:6.2f}%")
+    print(f"\nTokens generados/s: {tokens_generados / tiempo_generacion:.1f}")
+    print(f"Latencia por ejemplo (ms): p50={percentiles[0.5]:.1f}  p95={percentiles[0.95]:.1f}  p99={percentiles[0.99]:.1f}")
+    print("="*50)
+
+    imprimir_fallos(df_resultados, ['Categoria', 'Contexto', 'Entrada', 'Esperado', 'Predicho'])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluación del modelo de horas.")
+    parser.add_argument("--modo", choices=["hora", "tlp"], default="hora",
+                        help="'hora': instrucción HH:MM con adaptadores PEFT; 'tlp': prompt de local_api_server.")
+    parser.add_argument("--dataset", default=None, help="Fichero JSONL de prueba.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Tamaño de lote en modo tlp.")
+    parser.add_argument("--limite", type=int, default=None, help="Evalúa sólo los N primeros ejemplos.")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    import pandas as pd
-    evaluate_model()
\ No newline at end of file
+    args = parse_args()
+    if args.modo == "tlp":
+        evaluate_tlp(args.dataset or TLP_TEST_DATASET_FILE, args.batch_size, args.limite)
+    else:
+        if args.dataset:
+            TEST_DATASET_FILE = args.dataset
+        evaluate_model()
\ No newline at end of file
@@ -1,23 +1,170 @@
+import os
+import json
+import argparse
+import importlib.util
 import torch
-from datasets import load_dataset
-from peft import LoraConfig, AutoPeftModelForCausalLM, get_peft_model, PeftModel
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments, BitsAndBytesConfig
-from trl import SFTTrainer
+import numpy as np
+from peft import LoraConfig, AutoPeftModelForCausalLM, get_peft_model
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, EarlyStoppingCallback
+from transformers.trainer_utils import get_last_checkpoint
+from datasets import concatenate_datasets, interleave_datasets
+from trl import SFTConfig, SFTTrainer
+from dataset_tokenizado import cargar_tarea
+from plantillas import tarea_de_fichero
 
 MODEL_ID = "Qwen/Qwen1.5-1.8B-Chat"
-DATASET_FILE = "datos_horas.jsonl"
 OUTPUT_DIR = "qwen_hora_qlora"
 
-def formatting_function(example):
-    instruction = example['instruction']
-    output = example['output']
+# Datasets de entrenamiento y su peso en la mezcla. La tarea (y por tanto la plantilla de plantillas.py)
+# se deduce de los campos de cada fichero: instruction/output -> "hora", peticion/contexto_base -> "tlp".
+DATASETS = [("datos_horas.jsonl", 1.0)]
+SEMILLA_MEZCLA = 42
 
-    text = f"Instrucción: {instruction}\nRespuesta: {output}"
+# Packing: varios ejemplos cortos ("Instrucción: ... Respuesta: 23:25") comparten una misma secuencia
+# de MAX_SEQ_LEN tokens (best-fit decreasing), en lugar de rellenar cada fila del batch con padding.
+# Los ejemplos empaquetados no se ven entre sí: cada uno reinicia sus position_ids y la atención se
+# restringe a su bloque (FlashAttention 2 si está instalado; si no, máscara por bloques con SDPA).
+PACKING = True
+MAX_SEQ_LEN = 256
+# Sin packing: agrupar en cada batch ejemplos de longitud parecida para reducir el padding
+GROUP_BY_LENGTH = True
+# Fichero (en OUTPUT_DIR) donde cada entrenamiento añade su rendimiento para comparar configuraciones
+RENDIMIENTO_FILE = "rendimiento.jsonl"
 
-    return text
+# Checkpoints cada SAVE_STEPS pasos en OUTPUT_DIR (se reanuda desde el último si existe)
+SAVE_STEPS = 200
+SAVE_TOTAL_LIMIT = 3
+# Evaluación periódica sobre ejemplos apartados de cada dataset: acierto exacto de la respuesta
+EVAL_FRACCION = 0.02
+EVAL_MAX_EJEMPLOS = 200 # Por dataset
+# Parada temprana: se detiene si el acierto exacto no mejora en PACIENCIA evaluaciones seguidas
+PACIENCIA = 3
 
-def trainModel():
-    dataset = load_dataset("json", data_files=DATASET_FILE, split="train")
+def cargar_mezcla(datasets, tokenizer):
+    """
+    Pre-tokeniza cada fichero con la plantilla de su tarea y los intercala según sus pesos.
+    Cada ejemplo lleva 'completion_mask' para calcular la loss sólo sobre la respuesta.
+    De cada fichero se apartan unos pocos ejemplos (EVAL_FRACCION) para la evaluación.
+    Devuelve (train, eval).
+    """
+    partes, evaluacion, pesos = [], [], []
+    for fichero, peso in datasets:
+        tarea = tarea_de_fichero(fichero)
+        dataset = cargar_tarea(fichero, tokenizer, tarea).select_columns(["input_ids", "completion_mask"])
+        num_eval = max(1, min(EVAL_MAX_EJEMPLOS, int(len(dataset) * EVAL_FRACCION)))
+        division = dataset.train_test_split(test_size=num_eval, seed=SEMILLA_MEZCLA)
+        print(f"{fichero}: tarea '{tarea}', {len(division['train'])} ejemplos (+{num_eval} de eval), peso {peso}")
+        partes.append(division['train'])
+        evaluacion.append(division['test'])
+        pesos.append(peso)
+
+    if len(partes) == 1:
+        return partes[0], evaluacion[0]
+    total = sum(pesos)
+    mezcla = interleave_datasets(partes, probabilities=[peso / total for peso in pesos],
+                                 seed=SEMILLA_MEZCLA, stopping_strategy="all_exhausted")
+    return mezcla, concatenate_datasets(evaluacion)
+
+def argmax_logits(logits, labels):
+    """Guarda sólo el token más probable de cada posición (los logits completos no caben en memoria)."""
+    if isinstance(logits, tuple):
+        logits = logits[0]
+    return logits.argmax(dim=-1)
+
+def exact_match(eval_pred):
+    """
+    Acierto exacto por ejemplo: todos los tokens de la respuesta (incluido el EOS) son el argmax dado el
+    prefijo correcto, que equivale a que la decodificación greedy produzca exactamente la respuesta.
+    Se puntúa cada tramo continuo de etiquetas != -100 (el prompt de cada ejemplo está enmascarado, así que
+    cada tramo es la respuesta de un ejemplo), no cada fila: con packing_strategy="bfd" el collator es
+    padding-free también en eval y cada batch llega aplanado en una sola fila con todos sus ejemplos.
+    """
+    predicciones, etiquetas = eval_pred.predictions[:, :-1], eval_pred.label_ids[:, 1:]
+    aciertos = total = 0
+    for prediccion, etiqueta in zip(predicciones, etiquetas):
+        respuesta = np.concatenate(([0], (etiqueta != -100).astype(np.int8), [0]))
+        limites = np.flatnonzero(np.diff(respuesta))
+        for inicio, fin in zip(limites[::2], limites[1::2]):
+            total += 1
+            aciertos += int(np.array_equal(prediccion[inicio:fin], etiqueta[inicio:fin]))
+    return {"exact_match": aciertos / total if total else 0.0}
+
+# (prompt, respuesta con EOS, ¿acierta?) para comprobar_exact_match(); un fallo en el primer token de la respuesta
+CASOS_EXACT_MATCH = [
+    ([11, 12, 13], [21, 22, 2], True),
+    ([14, 15], [23, 2], False),
+    ([16, 17, 18, 19], [24, 25, 2], True),
+]
+
+def comprobar_exact_match():
+    """
+    exact_match sobre CASOS_EXACT_MATCH en un batch de eval del collator de TRL, padding-free (packing "bfd")
+    y con padding: en los dos casos debe puntuar por ejemplo. Devuelve la lista de fallos (modo, esperado, obtenido).
+    """
+    from transformers import EvalPrediction
+    from trl.trainer.sft_trainer import DataCollatorForLanguageModeling
+
+    ejemplos, predicciones = [], []
+    for prompt, respuesta, acierta in CASOS_EXACT_MATCH:
+        ids = prompt + respuesta
+        ejemplos.append({"input_ids": ids, "labels": [-100] * len(prompt) + respuesta})
+        # argmax "perfecto": en cada posición, el token siguiente
+        prediccion = ids[1:] + [0]
+        if not acierta:
+            prediccion[len(prompt) - 1] = 99
+        predicciones.append(prediccion)
+    esperado = sum(acierta for _, _, acierta in CASOS_EXACT_MATCH) / len(CASOS_EXACT_MATCH)
+
+    fallos = []
+    for padding_free in (True, False):
+        batch = DataCollatorForLanguageModeling(pad_token_id=0, padding_free=padding_free)(ejemplos)
+        etiquetas = batch["labels"].numpy()
+        if padding_free:
+            argmax = np.array([sum(predicciones, [])])
+        else:
+            argmax = np.full(etiquetas.shape, -100)
+            for fila, prediccion in enumerate(predicciones):
+                argmax[fila, :len(prediccion)] = prediccion
+        obtenido = exact_match(EvalPrediction(predictions=argmax, label_ids=etiquetas))["exact_match"]
+        if etiquetas.shape[0] != (1 if padding_free else len(ejemplos)) or not np.isclose(obtenido, esperado):
+            fallos.append(("padding-free" if padding_free else "padding", esperado, obtenido))
+    return fallos
+
+def attn_implementation():
+    """FlashAttention 2 si está disponible (CUDA); si no, SDPA, que también respeta los límites del packing."""
+    if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") is not None:
+        return "flash_attention_2"
+    return "sdpa"
+
+def guardar_rendimiento(metricas, packing, num_ejemplos, datasets):
+    """Calcula los tokens efectivos por segundo (sin padding) y los añade a OUTPUT_DIR/RENDIMIENTO_FILE."""
+    tokens = metricas.get("num_input_tokens_seen", 0)
+    duracion = metricas["train_runtime"]
+    rendimiento = {
+        "datasets": [f"{fichero}:{peso}" for fichero, peso in datasets],
+        "ejemplos": num_ejemplos,
+        "packing": packing,
+        "group_by_length": GROUP_BY_LENGTH and not packing,
+        "max_seq_len": MAX_SEQ_LEN,
+        "duracion_s": round(duracion, 2),
+        "tokens_efectivos": tokens,
+        "tokens_efectivos_por_s": round(tokens / duracion, 1) if duracion else None,
+        "ejemplos_por_s": metricas.get("train_samples_per_second"),
+    }
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(os.path.join(OUTPUT_DIR, RENDIMIENTO_FILE), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(rendimiento, ensure_ascii=False) + "\n")
+
+    print(f"Rendimiento ({'packing' if packing else 'sin packing'}): "
+          f"{rendimiento['tokens_efectivos_por_s']} tokens efectivos/s en {rendimiento['duracion_s']}s")
+    return rendimiento
+
+def trainModel(datasets=DATASETS, packing=PACKING, max_steps=-1, reanudar=True):
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+    tokenizer.pad_token = tokenizer.eos_token
+
+    # Pre-tokenizado una sola vez (con EOS al final, como haría SFTTrainer) y abierto en memoria mapeada
+    dataset, dataset_eval = cargar_mezcla(datasets, tokenizer)
 
     bnb_config = BitsAndBytesConfig(
         load_in_4bit=True,
@@ -37,24 +184,44 @@ def trainModel():
     model = AutoModelForCausalLM.from_pretrained(
         MODEL_ID,
         quantization_config=bnb_config,
-        device_map="auto"
+        device_map="auto",
+        attn_implementation=attn_implementation(),
     )
 
+    # Necesario también para el packing: sin KV cache, SDPA deduce los límites de cada ejemplo de los position_ids
     model.config.use_cache = False
 
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
-    tokenizer.pad_token = tokenizer.eos_token
-
-    training_args = TrainingArguments(
+    # Con packing cada batch de 4 secuencias de MAX_SEQ_LEN tokens ya contiene decenas de ejemplos,
+    # así que no hace falta acumular gradientes para llegar a un batch efectivo razonable.
+    # num_train_epochs es el máximo: la parada temprana suele cortar mucho antes.
+    training_args = SFTConfig(
         output_dir=OUTPUT_DIR,
         num_train_epochs=3,
+        max_steps=max_steps,
         per_device_train_batch_size=4,
-        gradient_accumulation_steps=4,
+        per_device_eval_batch_size=16,
+        gradient_accumulation_steps=1 if packing else 4,
         optim="paged_adamw_8bit",
         logging_steps=10,
-        save_strategy="epoch",
+        save_strategy="steps",
+        save_steps=SAVE_STEPS,
+        save_total_limit=SAVE_TOTAL_LIMIT,
+        eval_strategy="steps",
+        eval_steps=SAVE_STEPS,
+        # Sin packing en eval, pero el collator sigue siendo padding-free (packing_strategy="bfd"):
+        # cada batch de eval llega en una sola fila y exact_match separa los ejemplos por tramos de respuesta
+        eval_packing=False,
+        metric_for_best_model="exact_match",
+        greater_is_better=True,
+        load_best_model_at_end=True,
         learning_rate=2e-4,
         fp16=True,
+        packing=packing,
+        packing_strategy="bfd",
+        max_length=MAX_SEQ_LEN,
+        train_sampling_strategy="group_by_length" if GROUP_BY_LENGTH and not packing else "random",
+        include_num_input_tokens_seen="non_padding",
+        completion_only_loss=True, # Los tokens del prompt no cuentan en la loss (completion_mask)
     )
 
 
@@ -62,25 +229,60 @@ def trainModel():
         model=model,
         args=training_args,
         train_dataset=dataset,
+        eval_dataset=dataset_eval,
         peft_config=peft_config,
-        # tokenizer=tokenizer,
-        # packing=False,
-        formatting_func=formatting_function,
+        processing_class=tokenizer,
+        compute_metrics=exact_match,
+        preprocess_logits_for_metrics=argmax_logits,
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=PACIENCIA)],
     )
 
-    print("Iniciando entrenamiento...")
-    trainer.train()
+    # Reanudar desde el último checkpoint de OUTPUT_DIR (si el proceso anterior se interrumpió)
+    checkpoint = get_last_checkpoint(OUTPUT_DIR) if reanudar and os.path.isdir(OUTPUT_DIR) else None
+    if checkpoint:
+        print(f"Reanudando desde {checkpoint}")
 
+    print(f"Iniciando entrenamiento ({'packing' if packing else 'sin packing'})...")
+    resultado = trainer.train(resume_from_checkpoint=checkpoint)
+    guardar_rendimiento(dict(resultado.metrics, num_input_tokens_seen=trainer.state.num_input_tokens_seen),
+                        packing, len(dataset), datasets)
+
+    # Con load_best_model_at_end el modelo final es el del checkpoint con mejor acierto exacto
+    print(f"Acierto exacto (eval): {trainer.state.best_metric} en {trainer.state.best_model_checkpoint}")
     trainer.model.save_pretrained("qwen_hora_final")
     print("Entrenamiento completado. Pesos guardados en: qwen_hora_final")
 
-    base_model = AutoModelForCausalLM.from_pretrained(MODEL_ID, torch_dtype = torch.bfloat16)
-    modelPert = PeftModel.from_pretrained(base_model, "qwen_hora_final")
-    merged_model = modelPert.merge_and_unload()
-    merged_model.save_pretrained("qwen_hora_fusionado")
-    tokenizer.save_pretrained("qwen_hora_fusionado")
+    # La fusión se hace aparte, shard a shard, para no cargar un segundo modelo en la máquina de entrenamiento
+    print("Para fusionar: python fusionar_adaptador.py --adaptador qwen_hora_final --salida qwen_hora_fusionado")
+
+def _dataset_con_peso(valor: str):
+    """'fichero.jsonl' o 'fichero.jsonl:peso'."""
+    fichero, _, peso = valor.rpartition(":")
+    try:
+        return fichero, float(peso)
+    except ValueError:
+        return valor, 1.0
 
-    print("Modelo fusionado guardado")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Entrenamiento QLoRA del modelo de horas.")
+    parser.add_argument("--dataset", action="append", type=_dataset_con_peso, default=None,
+                        help="FICHERO[:PESO]; se puede repetir para mezclar datasets (p. ej. "
+                             "--dataset datos_horas.jsonl:0.3 --dataset datos_horas_tlp_v4.jsonl:0.7).")
+    parser.add_argument("--sin-packing", action="store_true", help="Un ejemplo por fila con padding (modo anterior).")
+    parser.add_argument("--max-steps", type=int, default=-1,
+                        help="Limita los pasos (p. ej. para comparar tokens/s con y sin packing).")
+    parser.add_argument("--desde-cero", action="store_true", help="Ignora los checkpoints de OUTPUT_DIR.")
+    parser.add_argument("--comprobar-metrica", action="store_true",
+                        help="Comprueba exact_match con un batch de eval empaquetado y sale.")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    trainModel()
\ No newline at end of file
+    args = parse_args()
+    if args.comprobar_metrica:
+        fallos = comprobar_exact_match()
+        for modo, esperado, obtenido in fallos:
+            print(f"FALLO exact_match ({modo}): esperado {esperado:.3f}, obtenido {obtenido:.3f}")
+        print(f"{2 - len(fallos)}/2 comprobaciones de exact_match correctas.")
+        raise SystemExit(1 if fallos else 0)
+    trainModel(args.dataset or DATASETS, packing=not args.sin_packing, max_steps=args.max_steps,
+               reanudar=not args.desde_cero)